@@ -1,25 +1,173 @@
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 from fastapi.security import OAuth2PasswordBearer
+import asyncio
+import multiprocessing
 import os
+import time
+import uuid
+
+import cache
+import schemas
+from database import async_redis_client, redis_client
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Кэш проверенных токенов и статуса активности пользователей: большинство
+# авторизованных запросов обходятся без обращения к БД
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+AUTH_CHANNEL = "auth:invalidate"
+
+# Пользователи с доступом ко всем ссылкам (выгрузка и импорт), через запятую
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+
+# bcrypt выполняется в отдельном пуле процессов, чтобы всплеск входов не занимал
+# потоки и процессор воркера. Сверх лимита очереди запросы получают 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+_token_cache = cache.LocalCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+_active_cache = cache.LocalCache(TOKEN_CACHE_SIZE, USER_CACHE_TTL)
+# Отозванные jti, о которых воркер узнал по pub/sub; живут не дольше самих токенов
+_revoked = cache.LocalCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+class HashingOverloaded(Exception):
+    """Очередь хэширования паролей переполнена."""
+
+_executor: ProcessPoolExecutor | None = None
+_semaphore: asyncio.Semaphore | None = None
+_waiting = 0
+
+# jose и passlib импортируются при первом использовании: они нужны только
+# авторизованным запросам и не должны замедлять запуск воркера
+
+async def _run_in_hash_pool(fn, *args):
+    global _executor, _semaphore, _waiting
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют потоки и соединения воркера
+        _executor = ProcessPoolExecutor(PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        _semaphore = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
+    if _semaphore.locked() and _waiting >= PASSWORD_HASH_QUEUE_LIMIT:
+        raise HashingOverloaded()
+    _waiting += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _waiting -= 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _semaphore.release()
+
+async def hash_password(password: str) -> str:
+    """Хэширование пароля в пуле процессов."""
+    import passwords
+    return await _run_in_hash_pool(passwords.hash_password, password)
+
+async def verify_and_update_password(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Проверка пароля в пуле процессов; второй элемент — новый хэш, если старый устарел."""
+    import passwords
+    return await _run_in_hash_pool(passwords.verify_and_update, password, hashed_password)
+
+def shutdown_hash_pool() -> None:
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = _semaphore = None
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def hash_pool_stats() -> dict:
+    return {"workers": PASSWORD_HASH_WORKERS, "waiting": _waiting, "queue_limit": PASSWORD_HASH_QUEUE_LIMIT}
+
+def is_admin(user: schemas.UserClaims) -> bool:
+    return user.username in ADMIN_USERS
 
 def create_access_token(data: dict) -> str:
+    from jose import jwt
     expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = data.copy()
-    to_encode.update({"exp": datetime.now() + expires_delta})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
\ No newline at end of file
+    to_encode.update({"exp": datetime.now(timezone.utc) + expires_delta, "jti": uuid.uuid4().hex})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_token(token: str) -> schemas.UserClaims | None:
+    """Проверка подписи и срока действия токена без обращения к БД."""
+    from jose import JWTError, jwt
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except (JWTError, KeyError, TypeError):
+        return None
+    if not payload.get("sub"):
+        return None
+    return schemas.UserClaims(
+        id=payload.get("uid"),  # В старых токенах ID пользователя нет
+        username=payload["sub"],
+        jti=payload.get("jti"),
+        exp=payload["exp"],
+    )
+
+def _revoked_key(jti: str) -> str:
+    return f"auth:revoked:{jti}"
+
+async def verify_token(token: str) -> schemas.UserClaims | None:
+    """Проверка токена с кэшем: подпись проверяется и отзыв ищется в Redis только при промахе."""
+    claims = _token_cache.get(token)
+    if claims is None:
+        claims = decode_token(token)
+        if claims is None:
+            return None
+        if claims.jti and await async_redis_client.exists(_revoked_key(claims.jti)):
+            return None
+        cache_claims(token, claims)
+    if claims.jti and _revoked.get(claims.jti):
+        return None
+    return claims
+
+def cache_claims(token: str, claims: schemas.UserClaims) -> None:
+    ttl = min(TOKEN_CACHE_TTL, claims.exp - time.time())
+    if ttl > 0:
+        _token_cache.set(token, claims, ttl=ttl)
+
+def get_cached_user_active(user_id: int) -> bool | None:
+    return _active_cache.get(user_id)
+
+def cache_user_active(user_id: int, is_active: bool) -> None:
+    _active_cache.set(user_id, is_active)
+
+async def revoke_token(token: str) -> None:
+    """Отзыв токена: запись в Redis до истечения токена и сброс кэшей во всех воркерах."""
+    claims = decode_token(token)
+    _token_cache.invalidate(token)
+    if claims is None or not claims.jti:
+        return
+    ttl = int(claims.exp - time.time()) + 1
+    if ttl > 0:
+        await async_redis_client.setex(_revoked_key(claims.jti), ttl, 1)
+    _revoked.set(claims.jti, True)
+    await async_redis_client.publish(AUTH_CHANNEL, f"token:{claims.jti}")
+
+def evict_user(user_id: int) -> None:
+    """Сброс закэшированного статуса пользователя во всех воркерах (например, после деактивации)."""
+    _active_cache.invalidate(user_id)
+    redis_client.publish(AUTH_CHANNEL, f"user:{user_id}")
+
+def _on_auth_message(message: str) -> None:
+    kind, _, value = message.partition(":")
+    if kind == "token":
+        _revoked.set(value, True)
+    elif kind == "user":
+        _active_cache.invalidate(int(value))
+
+def _on_reconnect() -> None:
+    _token_cache.clear()
+    _active_cache.clear()
+
+cache.subscribe(AUTH_CHANNEL, _on_auth_message, on_reconnect=_on_reconnect)
@@ -0,0 +1,194 @@
+"""Фильтр Блума существующих коротких кодов.
+
+Каждый воркер держит фильтр в памяти и строит его по таблице links при подключении
+к Redis pub/sub. Новые коды рассылаются всем воркерам через канал bloom:links
+JSON-массивом. Код, которого нет в фильтре, точно не существует, и редирект
+отвечает 404 без запроса к БД. Удалённые коды остаются в фильтре ложными срабатываниями до следующей
+перестройки: её запрашивает очистка, когда удалено много ссылок.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+import cache
+import models
+from database import SessionLocal, async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))
+# Доля удалённых с последней перестройки кодов, после которой фильтр перестраивается
+BLOOM_REBUILD_DELETED_FRACTION = float(os.getenv("BLOOM_REBUILD_DELETED_FRACTION", "0.1"))
+
+BLOOM_CHANNEL = "bloom:links"
+DELETED_KEY = "bloom:deleted"
+
+stats = {
+    "absent": 0,            # фильтр ответил «кода нет» — 404 без БД
+    "false_positives": 0,   # фильтр ответил «возможно есть», а в БД ссылки нет
+    "rebuilds": 0,
+    "last_rebuild_at": None,
+    "last_rebuild_seconds": None,
+}
+
+
+class BloomFilter:
+    """Битовый массив и k хэш-функций (двойное хэширование blake2b)."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+_filter: BloomFilter | None = None     # None — фильтр ещё не построен, проверка пропускается
+_building: BloomFilter | None = None   # строящийся фильтр тоже получает новые коды
+_lock = threading.Lock()
+_rebuild_running = threading.Event()
+
+
+def might_contain(short_code: str) -> bool:
+    """False — ссылки с таким кодом точно нет."""
+    current = _filter
+    if current is None or short_code in current:
+        return True
+    stats["absent"] += 1
+    return False
+
+
+def record_false_positive(short_code: str) -> None:
+    """Учитывает ссылку, которой нет в БД, если фильтр построен и пропустил её код."""
+    current = _filter
+    if current is not None and short_code in current:
+        stats["false_positives"] += 1
+
+
+def add(short_codes) -> None:
+    with _lock:
+        for target in (_filter, _building):
+            if target is not None:
+                for short_code in short_codes:
+                    # Свои же сообщения тоже приходят по pub/sub — не считаем код дважды
+                    if short_code not in target:
+                        target.add(short_code)
+    # Отрицательные записи L1 для новых кодов (например, кастомного алиаса) больше не верны
+    for short_code in short_codes:
+        cache.l1.invalidate(short_code)
+
+
+def announce(short_codes: list[str]) -> None:
+    """Добавляет новые коды в фильтры всех воркеров."""
+    if not short_codes:
+        return
+    add(short_codes)
+    redis_client.publish(BLOOM_CHANNEL, "add:" + json.dumps(short_codes))
+
+
+async def announce_async(short_codes: list[str]) -> None:
+    if not short_codes:
+        return
+    add(short_codes)
+    await async_redis_client.publish(BLOOM_CHANNEL, "add:" + json.dumps(short_codes))
+
+
+def rebuild() -> None:
+    """Строит фильтр заново по таблице links (в фоне; запросы до конца работают со старым)."""
+    global _filter, _building
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        total = db.scalar(select(func.count()).select_from(models.Link))
+        with _lock:
+            # Запас на рост, чтобы доля ложных срабатываний не ушла выше BLOOM_ERROR_RATE
+            _building = BloomFilter(max(BLOOM_CAPACITY, int(total * 1.5)), BLOOM_ERROR_RATE)
+        codes = db.execute(select(models.Link.short_code).execution_options(yield_per=10000)).scalars()
+        for partition in codes.partitions():
+            with _lock:
+                for short_code in partition:
+                    _building.add(short_code)
+    with _lock:
+        _filter, _building = _building, None
+
+    stats["rebuilds"] += 1
+    stats["last_rebuild_at"] = datetime.now(timezone.utc).isoformat()
+    stats["last_rebuild_seconds"] = round(time.perf_counter() - started, 3)
+
+
+def _rebuild_in_background() -> None:
+    if _rebuild_running.is_set():
+        return
+    _rebuild_running.set()
+
+    def run():
+        try:
+            rebuild()
+        except Exception:
+            logger.exception("Не удалось перестроить фильтр коротких кодов")
+        finally:
+            _rebuild_running.clear()
+
+    threading.Thread(target=run, name="bloom-rebuild", daemon=True).start()
+
+
+def note_deleted(count: int) -> None:
+    """Учитывает удалённые ссылки; при большой доле устаревших кодов все воркеры перестраивают фильтр."""
+    if not count:
+        return
+    deleted = redis_client.incrby(DELETED_KEY, count)
+    current = _filter
+    capacity = current.count if current is not None else BLOOM_CAPACITY
+    if deleted >= max(capacity, 1) * BLOOM_REBUILD_DELETED_FRACTION:
+        redis_client.delete(DELETED_KEY)
+        redis_client.publish(BLOOM_CHANNEL, "rebuild")
+
+
+def _on_message(message: str) -> None:
+    kind, _, value = message.partition(":")
+    if kind == "add":
+        # JSON-массив: в пользовательском алиасе может быть любой символ, в том числе запятая
+        add(json.loads(value))
+    elif kind == "rebuild":
+        _rebuild_in_background()
+
+
+def get_stats() -> dict:
+    current = _filter
+    checked = stats["absent"] + stats["false_positives"]
+    return {
+        **stats,
+        "ready": current is not None,
+        "items": current.count if current is not None else 0,
+        "size_bytes": len(current._bits) if current is not None else 0,
+        "hashes": current.hashes if current is not None else 0,
+        # Среди кодов, которых нет в БД, — доля пропущенных фильтром
+        "false_positive_rate": round(stats["false_positives"] / checked, 6) if checked else None,
+    }
+
+
+# Пока подписки не было, новые коды могли пройти мимо — фильтр строится заново
+cache.subscribe(BLOOM_CHANNEL, _on_message, on_reconnect=_rebuild_in_background)
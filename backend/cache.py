@@ -0,0 +1,523 @@
+"""Многоуровневый кэш коротких ссылок.
+
+L1 — ограниченный LRU/TTL-кэш в памяти процесса, L2 — Redis. Изменения ссылок
+публикуются в канал Redis, и каждый воркер сразу сбрасывает устаревшие записи L1.
+Кроме URL для редиректа в Redis хранится полная запись ссылки (хэш linkrec:*),
+из которой без SQL отвечают эндпоинты статистики и проверки прав.
+
+Промах по URL загружается из БД один раз на воркер (общий future) и один раз на
+кластер (короткая блокировка в Redis); популярные ключи обновляются заранее,
+до истечения TTL (вероятностный XFetch), пока запросы получают текущее значение.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+
+import schemas
+import ttl_policy
+from database import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "1024"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "30"))
+# Отрицательные записи (кода нет в БД) хранятся как пустая строка и живут недолго
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+
+# Защита от лавины промахов: время жизни блокировки загрузки и ожидание чужой загрузки
+STAMPEDE_LOCK_MS = int(os.getenv("STAMPEDE_LOCK_MS", "2000"))
+STAMPEDE_WAIT = float(os.getenv("STAMPEDE_WAIT", "0.5"))
+STAMPEDE_POLL_INTERVAL = 0.02
+# XFetch: чем больше beta и дольше загрузка, тем раньше обновляется ключ
+XFETCH_BETA = float(os.getenv("XFETCH_BETA", "1.0"))
+XFETCH_MIN_DELTA = float(os.getenv("XFETCH_MIN_DELTA", "0.05"))
+
+INVALIDATION_CHANNEL = "link:invalidate"
+
+# Версия формата записи вычисляется по полям схемы: после изменения схемы
+# старые записи просто перестают читаться и вытесняются по TTL.
+LINK_RECORD_VERSION = hashlib.sha1(
+    ",".join(f"{name}:{field.annotation}" for name, field in schemas.LinkRecord.model_fields.items()).encode()
+).hexdigest()[:8]
+
+
+class LocalCache:
+    """Потокобезопасный LRU-кэш с ограничением по размеру и TTL записей."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+l1 = LocalCache(L1_CACHE_SIZE, L1_CACHE_TTL)
+
+tier_stats = {
+    "l1": {"hits": 0, "misses": 0},
+    "redis": {"hits": 0, "misses": 0},
+    "record": {"hits": 0, "misses": 0},
+}
+
+
+def _count(tier: str, hit: bool) -> None:
+    tier_stats[tier]["hits" if hit else "misses"] += 1
+
+
+def _set_l1(short_code: str, url: str, ttl: float | None = None) -> None:
+    """Запись в L1, которая не переживёт ключ в Redis (ttl — его оставшееся время, с)."""
+    limit = l1.ttl if url else min(NEGATIVE_CACHE_TTL, l1.ttl)
+    l1.set(short_code, url, ttl=min(limit, ttl) if ttl is not None and ttl > 0 else limit)
+
+
+async def _read_redis(short_code: str) -> tuple[str | None, int]:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(f"link:{short_code}")
+        pipe.pttl(f"link:{short_code}")
+        url, ttl_ms = await pipe.execute()
+    if url is not None:
+        _set_l1(short_code, url, ttl_ms / 1000)
+    return url, ttl_ms
+
+
+async def get_url_async(short_code: str, loader=None) -> str | None:
+    """Ищет оригинальный URL сначала в L1, затем в Redis. Пустая строка — ссылки точно нет.
+
+    С loader ключ, который скоро истечёт, с вероятностью по XFetch обновляется
+    в фоне через load_url, а запрос сразу получает текущее значение.
+    """
+    url = l1.get(short_code)
+    _count("l1", url is not None)
+    if url is None:
+        url, ttl_ms = await _read_redis(short_code)
+        _count("redis", url is not None)
+        if url and loader is not None and _should_refresh_early(ttl_ms):
+            stampede_stats["early_refreshes"] += 1
+            _run_in_background(load_url(short_code, loader, background=True))
+    if url != "":
+        ttl_policy.record_lookup(short_code, url is not None)
+    return url
+
+
+async def set_url_async(short_code: str, url: str, ttl: int) -> None:
+    await async_redis_client.setex(f"link:{short_code}", ttl, url)
+    _set_l1(short_code, url, ttl)
+
+
+async def set_missing_async(short_code: str) -> None:
+    """Запоминает, что ссылки нет. NX: не затирает URL, если ссылку успели создать."""
+    await async_redis_client.set(f"link:{short_code}", "", ex=int(NEGATIVE_CACHE_TTL), nx=True)
+    l1.set(short_code, "", ttl=min(NEGATIVE_CACHE_TTL, l1.ttl))
+
+
+stampede_stats = {
+    "loads": 0,            # загрузок из БД
+    "coalesced": 0,        # запросов, дождавшихся загрузки в этом же воркере
+    "lock_waits": 0,       # запросов, дождавшихся загрузки другого воркера
+    "lock_timeouts": 0,    # не дождались и загрузили сами
+    "early_refreshes": 0,  # фоновых обновлений до истечения TTL
+}
+
+_inflight: dict[str, asyncio.Future] = {}
+_background_tasks: set = set()
+_load_seconds = XFETCH_MIN_DELTA  # скользящее среднее времени загрузки
+
+_release_lock_script = async_redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def _should_refresh_early(ttl_ms: int) -> bool:
+    """XFetch: обновить с вероятностью, растущей по мере приближения к истечению."""
+    if ttl_ms is None or ttl_ms < 0:
+        return False
+    delta = max(_load_seconds, XFETCH_MIN_DELTA)
+    return delta * XFETCH_BETA * -math.log(1.0 - random.random()) >= ttl_ms / 1000
+
+
+def _run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+
+
+def _background_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Не удалось обновить ссылку в кэше", exc_info=task.exception())
+
+
+async def _load(short_code: str, loader) -> str | None:
+    global _load_seconds
+    started = time.perf_counter()
+    link = await loader(short_code)
+    _load_seconds = 0.9 * _load_seconds + 0.1 * (time.perf_counter() - started)
+    stampede_stats["loads"] += 1
+    ttl = ttl_policy.ttl_for(short_code, link.expires_at) if link is not None else 0
+    if ttl <= 0:
+        # Ссылки нет или её срок истёк
+        await set_missing_async(short_code)
+        return None
+    await set_url_async(short_code, link.original_url, ttl)
+    return link.original_url
+
+
+async def _load_across_workers(short_code: str, loader, background: bool) -> str | None:
+    lock_key = f"lock:link:{short_code}"
+    token = uuid.uuid4().hex
+    if await async_redis_client.set(lock_key, token, nx=True, px=STAMPEDE_LOCK_MS):
+        try:
+            return await _load(short_code, loader)
+        finally:
+            await _release_lock_script(keys=[lock_key], args=[token])
+    if background:
+        return None  # Ключ уже обновляет другой воркер
+
+    # Ссылку загружает другой воркер — ждём, пока она появится в Redis
+    stampede_stats["lock_waits"] += 1
+    deadline = time.monotonic() + STAMPEDE_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(STAMPEDE_POLL_INTERVAL)
+        url, _ = await _read_redis(short_code)
+        if url is not None:
+            return url or None
+    stampede_stats["lock_timeouts"] += 1
+    return await _load(short_code, loader)
+
+
+async def load_url(short_code: str, loader, background: bool = False) -> str | None:
+    """Загружает URL через loader и кладёт в кэш с TTL из ttl_policy.
+
+    loader — корутина short_code -> ссылка (original_url, expires_at) или None.
+
+    Одновременные промахи по одному коду в воркере ждут одну загрузку, а между
+    воркерами загрузку выполняет тот, кто взял блокировку lock:link:<код>.
+    Отсутствующая или истёкшая ссылка кэшируется как отрицательная запись.
+    """
+    future = _inflight.get(short_code)
+    if future is not None:
+        if background:
+            return None
+        stampede_stats["coalesced"] += 1
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[short_code] = future
+    try:
+        url = await _load_across_workers(short_code, loader, background)
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # Ожидающих может не быть — не предупреждать о непрочитанной ошибке
+        raise
+    else:
+        future.set_result(url)
+        return url
+    finally:
+        _inflight.pop(short_code, None)
+
+
+def _record_key(short_code: str) -> str:
+    return f"linkrec:{LINK_RECORD_VERSION}:{short_code}"
+
+
+def _encode_record(record: schemas.LinkRecord) -> dict[str, str]:
+    encoded = {}
+    for name, value in record.model_dump().items():
+        if value is None:
+            encoded[name] = ""
+        elif isinstance(value, bool):
+            encoded[name] = "1" if value else "0"
+        elif hasattr(value, "isoformat"):
+            encoded[name] = value.isoformat()
+        else:
+            encoded[name] = str(value)
+    return encoded
+
+
+def _decode_record(data: dict[str, str]) -> schemas.LinkRecord | None:
+    try:
+        return schemas.LinkRecord.model_validate({k: (v if v != "" else None) for k, v in data.items()})
+    except ValueError:
+        logger.warning("Повреждённая запись ссылки в кэше: %s", data.get("short_code"))
+        return None
+
+
+def get_link_record(short_code: str) -> schemas.LinkRecord | None:
+    data = redis_client.hgetall(_record_key(short_code))
+    _count("record", bool(data))
+    return _decode_record(data) if data else None
+
+
+async def get_link_record_async(short_code: str) -> schemas.LinkRecord | None:
+    data = await async_redis_client.hgetall(_record_key(short_code))
+    _count("record", bool(data))
+    return _decode_record(data) if data else None
+
+
+def _queue_link_record(pipe, record: schemas.LinkRecord, ttl: int | None = None) -> None:
+    key = _record_key(record.short_code)
+    pipe.delete(key)
+    if ttl is None:
+        ttl = ttl_policy.ttl_for(record.short_code, record.expires_at)
+    if ttl > 0:
+        pipe.hset(key, mapping=_encode_record(record))
+        pipe.expire(key, ttl)
+
+
+def set_link_record(record: schemas.LinkRecord) -> None:
+    """Атомарно (MULTI) заменяет запись ссылки в кэше."""
+    pipe = redis_client.pipeline()
+    _queue_link_record(pipe, record)
+    pipe.execute()
+
+
+async def set_link_record_async(record: schemas.LinkRecord) -> None:
+    async with async_redis_client.pipeline() as pipe:
+        _queue_link_record(pipe, record)
+        await pipe.execute()
+
+
+def _queue_warm(pipe, record: schemas.LinkRecord, tier: str | None) -> None:
+    ttl = ttl_policy.ttl_for(record.short_code, record.expires_at, tier)
+    if ttl > 0:
+        pipe.setex(f"link:{record.short_code}", ttl, record.original_url)
+        _queue_link_record(pipe, record, ttl)
+
+
+def warm(
+    records: list[schemas.LinkRecord], batch_size: int = 500, tier: str | None = None, only_missing: bool = False,
+) -> int:
+    """Заранее кладёт URL и записи ссылок в Redis пачками через pipeline.
+
+    tier задаёт уровень TTL явно (например, для прогрева популярных ссылок),
+    иначе он определяется счётчиком популярности воркера. only_missing — не
+    трогать ссылки, которые уже есть в Redis: их TTL выбран политикой по
+    популярности. Возвращает число записанных ссылок.
+    """
+    written = 0
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        if only_missing:
+            pipe = redis_client.pipeline(transaction=False)
+            for record in batch:
+                pipe.exists(f"link:{record.short_code}")
+            batch = [record for record, exists in zip(batch, pipe.execute()) if not exists]
+            if not batch:
+                continue
+        pipe = redis_client.pipeline(transaction=False)
+        for record in batch:
+            _queue_warm(pipe, record, tier)
+        pipe.execute()
+        written += len(batch)
+    return written
+
+
+async def warm_async(records: list[schemas.LinkRecord], tier: str | None = None) -> None:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for record in records:
+            _queue_warm(pipe, record, tier)
+        await pipe.execute()
+
+
+_bump_records_script = redis_client.register_script("""
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HINCRBY', key, 'clicks', ARGV[2 * i - 1])
+        redis.call('HSET', key, 'last_accessed', ARGV[2 * i])
+    end
+end
+return 0
+""")
+
+
+def bump_link_records(rows: list[tuple[str, int, str]]) -> None:
+    """Добавляет записанные в БД переходы к закэшированным записям, если они есть.
+
+    rows — кортежи (short_code, число переходов, время последнего перехода в ISO).
+    """
+    for i in range(0, len(rows), 500):
+        chunk = rows[i:i + 500]
+        keys = [_record_key(code) for code, _, _ in chunk]
+        args = [value for _, n, ts in chunk for value in (n, ts)]
+        _bump_records_script(keys=keys, args=args)
+
+
+# URL и запись изменённой ссылки заменяются вместе. TTL не короче оставшегося у
+# текущего ключа (популярная ссылка не теряет уровень из-за правки на воркере, где
+# по ней не было переходов), но не дольше срока жизни ссылки (ARGV[3], -1 — бессрочная)
+_write_through_script = redis_client.register_script("""
+local ttl = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+if redis.call('STRLEN', KEYS[1]) > 0 then
+    ttl = math.max(ttl, math.ceil(redis.call('PTTL', KEYS[1]) / 1000))
+end
+if cap >= 0 then
+    ttl = math.min(ttl, cap)
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+redis.call('DEL', KEYS[2])
+redis.call('HSET', KEYS[2], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[2], ttl)
+return ttl
+""")
+
+
+def write_through(records=(), deleted=(), batch_size: int = 500) -> None:
+    """Записывает изменённые (records) и удалённые (deleted) ссылки в Redis после коммита.
+
+    Пачка применяется одной транзакцией MULTI, поэтому редирект никогда не видит
+    новый URL со старой записью или пустой ключ между удалением и записью.
+    Удалённые и истёкшие ссылки становятся отрицательными записями. Остальные
+    воркеры сбрасывают L1 по каналу инвалидации и читают новое значение из Redis.
+    """
+    updates = []
+    deleted = list(deleted)
+    for record in records:
+        ttl = ttl_policy.ttl_for(record.short_code, record.expires_at)
+        if ttl > 0:
+            updates.append((record, ttl))
+        else:
+            deleted.append(record.short_code)
+
+    for i in range(0, max(len(updates), len(deleted)), batch_size):
+        batch_updates = updates[i:i + batch_size]
+        batch_deleted = deleted[i:i + batch_size]
+        pipe = redis_client.pipeline()
+        for record, ttl in batch_updates:
+            cap = max(1, int(ttl_policy.seconds_left(record.expires_at))) if record.expires_at else -1
+            fields = [value for item in _encode_record(record).items() for value in item]
+            _write_through_script(
+                keys=[f"link:{record.short_code}", _record_key(record.short_code)],
+                args=[record.original_url, ttl, cap, *fields],
+                client=pipe,
+            )
+        for short_code in batch_deleted:
+            pipe.set(f"link:{short_code}", "", ex=int(NEGATIVE_CACHE_TTL))
+            pipe.delete(_record_key(short_code))
+        codes = [record.short_code for record, _ in batch_updates] + batch_deleted
+        for short_code in codes:
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        try:
+            replies = pipe.execute()
+        except redis.RedisError:
+            # Хотя бы этот воркер не отдаёт старое значение, пока изменение не повторят
+            for short_code in codes:
+                l1.invalidate(short_code)
+            raise
+        for (record, _), ttl in zip(batch_updates, replies):
+            _set_l1(record.short_code, record.original_url, ttl)
+        for short_code in batch_deleted:
+            _set_l1(short_code, "")
+
+
+def purge(short_codes: list[str], batch_size: int = 500) -> None:
+    """Вычищает удалённые ссылки из Redis и L1 всех воркеров пачками через pipeline."""
+    for i in range(0, len(short_codes), batch_size):
+        batch = short_codes[i:i + batch_size]
+        pipe = redis_client.pipeline(transaction=False)
+        for short_code in batch:
+            pipe.delete(f"link:{short_code}", _record_key(short_code))
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        pipe.execute()
+        for short_code in batch:
+            l1.invalidate(short_code)
+
+
+def get_stats() -> dict:
+    result = {}
+    for tier, counters in tier_stats.items():
+        total = counters["hits"] + counters["misses"]
+        result[tier] = {
+            **counters,
+            "hit_ratio": round(counters["hits"] / total, 4) if total else None,
+        }
+    result["l1"]["size"] = len(l1)
+    result["l1"]["maxsize"] = l1.maxsize
+    result["stampede"] = dict(stampede_stats)
+    return result
+
+
+# Каналы инвалидации: канал -> (обработчик сообщения, сброс при переподключении)
+_channels = {}
+
+
+def subscribe(channel: str, handler, on_reconnect=None) -> None:
+    """Регистрирует обработчик канала инвалидации; вызывать до запуска InvalidationListener."""
+    _channels[channel] = (handler, on_reconnect)
+
+
+subscribe(INVALIDATION_CHANNEL, l1.invalidate, on_reconnect=l1.clear)
+
+
+class InvalidationListener(threading.Thread):
+    """Фоновый поток, сбрасывающий локальные кэши по сообщениям из Redis pub/sub."""
+
+    def __init__(self):
+        super().__init__(name="l1-invalidation", daemon=True)
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(*_channels)
+                # Пока подписки не было, сообщения могли потеряться
+                for _, on_reconnect in _channels.values():
+                    if on_reconnect:
+                        on_reconnect()
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        handler, _ = _channels[message["channel"]]
+                        handler(message["data"])
+            except redis.RedisError:
+                logger.warning("Подписка на инвалидацию L1 прервана, переподключение", exc_info=True)
+                self._stopped.wait(1)
+            finally:
+                pubsub.close()
+
+    def stop(self) -> None:
+        self._stopped.set()
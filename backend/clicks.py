@@ -0,0 +1,266 @@
+"""Буферизованный подсчёт переходов по ссылкам.
+
+В пути запроса переход только фиксируется в Redis (HINCRBY/HSET), а фоновый
+flusher периодически переносит накопленные счётчики в таблицу links пачками UPDATE.
+Необработанные переходы хранятся в Redis и переживают перезапуск воркера.
+
+Поминутные счётчики из того же снимка сворачиваются в интервалы по минуте, часу
+и суткам и добавляются в link_click_buckets в той же транзакции.
+
+Снимок может быть обработан дважды: его подхватывает другой воркер, если запись
+длится дольше ORPHAN_AFTER, или удаление из Redis не удалось после коммита.
+Поэтому идентификатор снимка (поле id, сохраняется при повторном захвате)
+записывается в applied_click_snapshots в той же транзакции, что и переходы, и
+повторная обработка снимка только удаляет его из Redis.
+"""
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import redis
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+import cache
+import models
+import ttl_policy
+from database import SessionLocal, async_redis_client, dialect_insert, redis_client
+
+logger = logging.getLogger(__name__)
+
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "10"))
+CLICK_FLUSH_BATCH_SIZE = int(os.getenv("CLICK_FLUSH_BATCH_SIZE", "500"))
+
+PENDING_KEY = "clicks:pending"
+FLUSHING_PREFIX = "clicks:flushing:"
+# Снимок, который воркер не дописал в БД за это время, подхватывается повторно
+ORPHAN_AFTER = max(CLICK_FLUSH_INTERVAL * 5, 60)
+# Сколько секунд хранятся идентификаторы записанных снимков
+CLICK_SNAPSHOT_RETENTION = float(os.getenv("CLICK_SNAPSHOT_RETENTION", "86400"))
+
+# Размеры интервалов временных рядов переходов, секунды
+SERIES_BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+
+stats = {
+    "last_flush_at": None,
+    "last_flush_lag_seconds": None,
+    "last_flush_duration_seconds": None,
+    "last_batch_size": 0,
+    "flushed_clicks_total": 0,
+    "flush_errors_total": 0,
+    "duplicate_snapshots_total": 0,
+}
+
+_links = models.Link.__table__
+_update_stmt = (
+    update(_links)
+    .where(_links.c.short_code == bindparam("code"))
+    .values(clicks=_links.c.clicks + bindparam("n"), last_accessed=bindparam("ts"))
+)
+
+_buckets = models.LinkClickBucket.__table__
+_applied = models.AppliedClickSnapshot.__table__
+
+
+def _bucket_upsert_stmt(dialect_name: str):
+    stmt = dialect_insert(dialect_name)(_buckets)
+    return stmt.on_conflict_do_update(
+        index_elements=["short_code", "bucket_seconds", "bucket_start"],
+        set_={"clicks": _buckets.c.clicks + stmt.excluded.clicks},
+    )
+
+
+def _existing_codes(conn, short_codes: set[str]) -> set[str]:
+    codes = list(short_codes)
+    existing = set()
+    for i in range(0, len(codes), CLICK_FLUSH_BATCH_SIZE):
+        chunk = codes[i:i + CLICK_FLUSH_BATCH_SIZE]
+        existing.update(conn.execute(select(_links.c.short_code).where(_links.c.short_code.in_(chunk))).scalars())
+    return existing
+
+
+def _queue_click(pipe, short_code: str) -> None:
+    now = time.time()
+    pipe.hincrby(PENDING_KEY, f"n:{short_code}", 1)
+    pipe.hincrby(PENDING_KEY, f"m:{short_code}:{int(now // 60)}", 1)
+    pipe.hset(PENDING_KEY, f"t:{short_code}", now)
+    pipe.hsetnx(PENDING_KEY, "since", now)
+
+
+async def record_click_async(short_code: str) -> None:
+    """Фиксирует переход в Redis без обращения к БД."""
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        _queue_click(pipe, short_code)
+        await pipe.execute()
+
+
+def pending_snapshot_keys() -> list[str]:
+    return list(redis_client.scan_iter(match=f"{FLUSHING_PREFIX}*", count=100))
+
+
+def _new_snapshot_key() -> str:
+    return f"{FLUSHING_PREFIX}{int(time.time())}:{uuid.uuid4().hex}"
+
+
+# RENAME и запись id снимка одной командой: при повторном захвате брошенного
+# снимка id остаётся прежним
+_claim_script = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('HSETNX', KEYS[2], 'id', KEYS[2])
+return 1
+""")
+
+
+def _claim(source: str) -> str | None:
+    """Атомарно забирает ключ под новым именем снимка."""
+    target = _new_snapshot_key()
+    if not _claim_script(keys=[source, target]):
+        # Ключа нет: переходов не было или его уже забрал другой воркер
+        return None
+    return target
+
+
+def _claim_orphans() -> list[str]:
+    """Забирает снимки, брошенные упавшими воркерами."""
+    claimed = []
+    now = time.time()
+    for key in pending_snapshot_keys():
+        try:
+            created = int(key[len(FLUSHING_PREFIX):].split(":", 1)[0])
+        except ValueError:
+            continue
+        if now - created < ORPHAN_AFTER:
+            continue
+        target = _claim(key)
+        if target:
+            claimed.append(target)
+    return claimed
+
+
+def _flush_snapshot(key: str) -> int:
+    data = redis_client.hgetall(key)
+    started = time.time()
+    snapshot_id = data.pop("id", key)
+    since = float(data.pop("since", started))
+
+    counts: dict[str, int] = {}
+    seen: dict[str, float] = {}
+    buckets: dict[tuple[str, int, int], int] = {}
+    for field, value in data.items():
+        kind, _, code = field.partition(":")
+        if kind == "n":
+            counts[code] = int(value)
+        elif kind == "t":
+            seen[code] = float(value)
+        elif kind == "m":
+            code, _, minute = code.rpartition(":")
+            ts = int(minute) * 60
+            for size in SERIES_BUCKETS.values():
+                bucket = (code, size, ts - ts % size)
+                buckets[bucket] = buckets.get(bucket, 0) + int(value)
+
+    rows = [
+        {
+            "code": code,
+            "n": counts.get(code, 0),
+            "ts": datetime.fromtimestamp(seen.get(code, since), timezone.utc),
+        }
+        for code in counts.keys() | seen.keys()
+    ]
+
+    bucket_rows = [
+        {
+            "short_code": code,
+            "bucket_seconds": size,
+            "bucket_start": datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None),
+            "clicks": n,
+        }
+        for (code, size, start), n in buckets.items()
+    ]
+
+    if rows or bucket_rows:
+        # Все пачки и id снимка пишутся одной транзакцией: частично применённый
+        # снимок при повторной обработке посчитал бы переходы дважды.
+        with SessionLocal() as db:
+            conn = db.connection()
+            try:
+                # Первым — id: параллельная обработка того же снимка ждёт здесь коммита
+                conn.execute(_applied.insert().values(snapshot_id=snapshot_id))
+            except IntegrityError:
+                db.rollback()
+                redis_client.delete(key)
+                stats["duplicate_snapshots_total"] += 1
+                logger.warning("Снимок переходов %s уже записан в БД, пропускаем", snapshot_id)
+                return 0
+            for i in range(0, len(rows), CLICK_FLUSH_BATCH_SIZE):
+                conn.execute(_update_stmt, rows[i:i + CLICK_FLUSH_BATCH_SIZE])
+            # Интервалы — только для ещё существующих ссылок: иначе ряд удалённой ссылки
+            # остался бы в таблице и достался коду, если его займут снова. Строки,
+            # обновлённые выше, заблокированы до коммита, и удаление их не опередит
+            live = _existing_codes(conn, {row["short_code"] for row in bucket_rows})
+            bucket_rows = [row for row in bucket_rows if row["short_code"] in live]
+            upsert = _bucket_upsert_stmt(conn.dialect.name)
+            for i in range(0, len(bucket_rows), CLICK_FLUSH_BATCH_SIZE):
+                conn.execute(upsert, bucket_rows[i:i + CLICK_FLUSH_BATCH_SIZE])
+            db.commit()
+
+    redis_client.delete(key)
+
+    try:
+        cache.bump_link_records(
+            [(row["code"], row["n"], row["ts"].replace(tzinfo=None).isoformat()) for row in rows]
+        )
+        ttl_policy.record_clicks(counts)
+    except redis.RedisError:
+        # Снимок уже записан в БД, повторять его нельзя: запись в кэше догонит БД по TTL
+        logger.warning("Не удалось обновить закэшированные записи ссылок", exc_info=True)
+
+    finished = time.time()
+    stats["last_flush_at"] = datetime.fromtimestamp(finished, timezone.utc).isoformat()
+    stats["last_flush_lag_seconds"] = round(finished - since, 3)
+    stats["last_flush_duration_seconds"] = round(finished - started, 3)
+    stats["last_batch_size"] = len(rows)
+    stats["flushed_clicks_total"] += sum(counts.values())
+    return len(rows)
+
+
+def flush_clicks() -> int:
+    """Переносит накопленные переходы в БД. Возвращает число обновлённых ссылок."""
+    snapshots = _claim_orphans()
+    current = _claim(PENDING_KEY)
+    if current:
+        snapshots.append(current)
+
+    updated = 0
+    for key in snapshots:
+        try:
+            updated += _flush_snapshot(key)
+        except Exception:
+            # Снимок остаётся в Redis и будет подхвачен как брошенный
+            stats["flush_errors_total"] += 1
+            logger.exception("Не удалось записать переходы из %s", key)
+    _prune_applied()
+    return updated
+
+
+def _prune_applied() -> None:
+    """Удаляет id снимков, которые уже не могут встретиться повторно."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=CLICK_SNAPSHOT_RETENTION)
+    with SessionLocal() as db:
+        db.execute(delete(_applied).where(_applied.c.applied_at < cutoff))
+        db.commit()
+
+
+def get_stats() -> dict:
+    return {
+        **stats,
+        # Поля n:/t: по ссылке и m: по каждой её минуте, поэтому считаем поля, а не ссылки
+        "pending_fields": redis_client.hlen(PENDING_KEY),
+        "pending_snapshots": len(pending_snapshot_keys()),
+        "flush_interval_seconds": CLICK_FLUSH_INTERVAL,
+    }
@@ -1,22 +1,46 @@
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+import auth
+import bloom
+import cache
 import models, schemas
-import random
-import string
+import outbox
+import shortcode
+from database import ReadSessionLocal, SessionLocal, dialect_insert, mark_written, mark_written_async, run_db_read
+import os
+import time
 from datetime import datetime, timedelta
-import pytz
-from database import redis_client
 from datetime import timezone
+from zoneinfo import ZoneInfo
 
 
-MOSCOW_TZ = pytz.timezone("Europe/Moscow")
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
 
-def generate_short_code(length: int = 6) -> str:
-    """Генерация случайного короткого кода."""
-    chars = string.ascii_letters + string.digits
-    return ''.join(random.choices(chars, k=length))
+CLEANUP_CHUNK_SIZE = int(os.getenv("CLEANUP_CHUNK_SIZE", "1000"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+INACTIVITY_DAYS = 7
 
-def create_link(db: Session, link: schemas.LinkCreate, user: models.User = None) -> models.Link:
-    """Создание ссылки. Временные ссылки (24 ч) для анонимных, вечные — только если указано is_permanent=True."""
+# Сколько хранить поминутные и почасовые интервалы переходов; суточные живут вместе со ссылкой
+CLICK_BUCKET_RETENTION = {
+    60: timedelta(days=int(os.getenv("CLICK_MINUTE_RETENTION_DAYS", "2"))),
+    3600: timedelta(days=int(os.getenv("CLICK_HOUR_RETENTION_DAYS", "90"))),
+}
+
+# Отчёт о последней очистке
+cleanup_stats = {}
+
+def _written_scopes(user_id: int | None, short_codes=()) -> list[str]:
+    """Области read-your-writes: следующие чтения этих ссылок и списка владельца идут в основную БД."""
+    scopes = [f"link:{short_code}" for short_code in short_codes]
+    if user_id is not None:
+        scopes.append(f"user:{user_id}")
+    return scopes
+
+
+def _link_values(link: schemas.LinkCreate, user: schemas.UserClaims = None) -> dict:
+    """Проверка прав и значения колонок новой ссылки (без short_code). Временные ссылки (24 ч) для анонимных, вечные — только если указано is_permanent=True."""
     
     if link.is_permanent and not user:
         raise ValueError("Вечные ссылки могут создавать только авторизованные пользователи")
@@ -29,14 +53,9 @@ def create_link(db: Session, link: schemas.LinkCreate, user: models.User = None)
         link.is_permanent = False
         link.expires_at = datetime.now(timezone.utc) + timedelta(days=1)
 
-    short_code = link.custom_alias.strip() if link.custom_alias else generate_short_code()
-    existing_link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
-    if existing_link:
-        raise ValueError(f"Код '{short_code}' уже существует!")
-
-    db_link = models.Link(
+    return dict(
         original_url=link.original_url,
-        short_code=short_code,
+        url_hash=models.url_hash(link.original_url),
         created_at=datetime.now(timezone.utc),
         expires_at=link.expires_at.astimezone(timezone.utc) if link.expires_at else None,
         is_permanent=link.is_permanent,
@@ -45,28 +64,404 @@ def create_link(db: Session, link: schemas.LinkCreate, user: models.User = None)
         clicks=0
     )
 
-    db.add(db_link)
+
+def _insert_link_stmt(dialect_name: str, values: dict):
+    """INSERT ... ON CONFLICT (short_code) DO NOTHING RETURNING: при занятом коде строк не возвращается."""
+    insert = dialect_insert(dialect_name)
+    return (
+        insert(models.Link)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=["short_code"])
+        .returning(models.Link)
+    )
+
+
+def _existing_link_query(owner_id: int, urls: list[str]):
+    """Действующие ссылки пользователя на те же URL: поиск по индексу (owner_id, url_hash)."""
+    return select(models.Link).where(
+        (models.Link.owner_id == owner_id)
+        & models.Link.url_hash.in_({models.url_hash(url) for url in urls})
+        # Сверяем и сам URL: совпадение 64-битных хэшей ещё не равенство
+        & models.Link.original_url.in_(set(urls))
+        & (models.Link.expires_at.is_(None) | (models.Link.expires_at > datetime.now(timezone.utc)))
+    ).order_by(models.Link.id)
+
+
+def _wants_existing(link: schemas.LinkCreate, user: schemas.UserClaims = None) -> bool:
+    return bool(link.reuse_existing and user and not link.custom_alias)
+
+
+def create_link(db: Session, link: schemas.LinkCreate, user: schemas.UserClaims = None) -> schemas.LinkRecord:
+    """Создание ссылки одним INSERT без предварительной проверки кода.
+
+    С reuse_existing=True авторизованному пользователю возвращается его уже
+    существующая ссылка на тот же URL.
+    """
+    if _wants_existing(link, user):
+        existing = db.scalars(_existing_link_query(user.id, [link.original_url])).first()
+        if existing:
+            return schemas.LinkRecord.model_validate(existing)
+
+    values = _link_values(link, user)
+    dialect_name = db.get_bind().dialect.name
+
+    if link.custom_alias:
+        short_code = link.custom_alias.strip()
+        db_link = db.scalars(_insert_link_stmt(dialect_name, {**values, "short_code": short_code})).first()
+        if db_link is None:
+            raise ValueError(f"Код '{short_code}' уже существует!")
+    else:
+        # Сгенерированные коды не повторяются; конфликт возможен только с кастомным
+        # алиасом или старым случайным кодом — тогда берём следующий идентификатор
+        db_link = None
+        while db_link is None:
+            db_link = db.scalars(_insert_link_stmt(dialect_name, {**values, "short_code": shortcode.generate()})).first()
+
+    record = schemas.LinkRecord.model_validate(db_link)
     db.commit()
-    db.refresh(db_link)
-    return db_link
+    # Сразу в кэш и фильтр кодов: первый редирект не идёт в БД и не получает ложный 404
+    cache.warm([record])
+    bloom.announce([record.short_code])
+    mark_written(*_written_scopes(record.owner_id, [record.short_code]))
+    return record
 
 
+async def create_link_async(db: AsyncSession, link: schemas.LinkCreate, user: schemas.UserClaims = None) -> schemas.LinkRecord:
+    """Асинхронный вариант create_link."""
+    if _wants_existing(link, user):
+        existing = (await db.scalars(_existing_link_query(user.id, [link.original_url]))).first()
+        if existing:
+            return schemas.LinkRecord.model_validate(existing)
 
+    values = _link_values(link, user)
+    dialect_name = db.get_bind().dialect.name
 
+    if link.custom_alias:
+        short_code = link.custom_alias.strip()
+        db_link = (await db.scalars(_insert_link_stmt(dialect_name, {**values, "short_code": short_code}))).first()
+        if db_link is None:
+            raise ValueError(f"Код '{short_code}' уже существует!")
+    else:
+        db_link = None
+        while db_link is None:
+            short_code = await shortcode.generate_async()
+            db_link = (await db.scalars(_insert_link_stmt(dialect_name, {**values, "short_code": short_code}))).first()
 
-def get_link_by_short_code(db: Session, short_code: str) -> models.Link | None:
-    """Получение ссылки с кэшированием"""
-    
-    cached_url = redis_client.get(f"link:{short_code}")
-    if cached_url:
-        print(f"✅ Кэш найден для {short_code}")
-        return db.query(models.Link).filter(models.Link.short_code == short_code).first()
+    record = schemas.LinkRecord.model_validate(db_link)
+    await db.commit()
+    await cache.warm_async([record])
+    await bloom.announce_async([record.short_code])
+    await mark_written_async(*_written_scopes(record.owner_id, [record.short_code]))
+    return record
+
+
+def create_links_chunk(
+    db: Session, items: list[tuple[int, schemas.LinkCreate]], user: schemas.UserClaims = None
+) -> list[tuple[int, schemas.LinkRecord | None, str | None]]:
+    """Создание пачки ссылок многострочным INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Возвращает (индекс, запись, ошибка) для каждого элемента: ошибка одного
+    элемента (нет прав, занятый алиас) не отменяет остальные. Созданные ссылки
+    сразу кладутся в кэш Redis.
+    """
+    results = []
+    pending: dict[str, tuple[int, dict]] = {}  # short_code -> (индекс, значения)
+    to_generate = []
+
+    reuse_urls = [link.original_url for _, link in items if _wants_existing(link, user)]
+    existing: dict[str, schemas.LinkRecord] = {}
+    if reuse_urls:
+        for db_link in db.scalars(_existing_link_query(user.id, reuse_urls)):
+            existing.setdefault(db_link.original_url, schemas.LinkRecord.model_validate(db_link))
+
+    for index, link in items:
+        if _wants_existing(link, user) and link.original_url in existing:
+            results.append((index, existing[link.original_url], None))
+            continue
+        try:
+            values = _link_values(link, user)
+        except ValueError as e:
+            results.append((index, None, str(e)))
+            continue
+        if not link.custom_alias:
+            to_generate.append((index, values))
+            continue
+        short_code = link.custom_alias.strip()
+        if short_code in pending:
+            results.append((index, None, f"Код '{short_code}' уже существует!"))
+        else:
+            pending[short_code] = (index, values)
+
+    aliases = set(pending)
+    table = models.Link.__table__
+    insert = dialect_insert(db.get_bind().dialect.name)
+    created = []
 
+    while pending or to_generate:
+        for short_code, entry in zip(shortcode.generate_many(len(to_generate)), to_generate):
+            pending[short_code] = entry
+        to_generate = []
+
+        rows = [{**values, "short_code": short_code} for short_code, (_, values) in pending.items()]
+        stmt = insert(table).values(rows).on_conflict_do_nothing(index_elements=["short_code"]).returning(table)
+        for row in db.execute(stmt):
+            index, _ = pending.pop(row.short_code)
+            record = schemas.LinkRecord.model_validate(dict(row._mapping))
+            created.append(record)
+            results.append((index, record, None))
+
+        # Оставшиеся строки не вставились из-за конфликта кода
+        for short_code, entry in pending.items():
+            if short_code in aliases:
+                results.append((entry[0], None, f"Код '{short_code}' уже существует!"))
+            else:
+                to_generate.append(entry)
+        pending = {}
+
+    db.commit()
+    cache.warm(created)
+    bloom.announce([record.short_code for record in created])
+    if created:
+        mark_written(*_written_scopes(user.id if user else None))
+    results.sort(key=lambda result: result[0])
+    return results
+
+
+EXPORT_FIELDS = ["short_code", "original_url", "created_at", "expires_at", "is_permanent", "clicks", "last_accessed", "owner_id"]
+
+
+def iter_links_for_export(owner_id: int | None = None, batch_size: int = EXPORT_BATCH_SIZE, read_only: bool = False):
+    """Пачки строк для выгрузки (owner_id=None — все ссылки).
+
+    Строки читаются серверным курсором (yield_per), поэтому память не зависит от
+    числа ссылок. Генератор сам открывает сессию и закрывает её по окончании;
+    с read_only=True — на реплике, если она настроена.
+    """
+    stmt = select(*(getattr(models.Link, name) for name in EXPORT_FIELDS))
+    if owner_id is None:
+        stmt = stmt.order_by(models.Link.id)
+    else:
+        # Порядок по индексу (owner_id, created_at, id) — без сортировки в памяти
+        stmt = stmt.where(models.Link.owner_id == owner_id).order_by(models.Link.created_at, models.Link.id)
+
+    with (ReadSessionLocal if read_only else SessionLocal)() as db:
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        for partition in result.mappings().partitions():
+            yield partition
+
+
+def _import_values(item: schemas.LinkImport, owner_id: int | None) -> dict:
+    now = datetime.now(timezone.utc)
+    is_permanent = item.is_permanent if item.is_permanent is not None else item.expires_at is None
+    return dict(
+        original_url=item.original_url,
+        url_hash=models.url_hash(item.original_url),
+        created_at=item.created_at or now,
+        expires_at=item.expires_at.astimezone(timezone.utc) if item.expires_at else None,
+        is_permanent=is_permanent,
+        owner_id=owner_id,
+        last_accessed=item.last_accessed or now,
+        clicks=item.clicks,
+    )
+
+
+def import_links_chunk(
+    db: Session,
+    items: list[tuple[int, schemas.LinkImport]],
+    user: schemas.UserClaims,
+    on_conflict: str = "skip",
+    keep_owner: bool = False,
+) -> dict:
+    """Импорт пачки ссылок многострочными INSERT ... ON CONFLICT.
+
+    items — (номер строки, ссылка). При занятом коде on_conflict=skip пропускает
+    строку, overwrite заменяет ссылку (только свою, если не keep_owner), rename
+    сохраняет строку под новым сгенерированным кодом. keep_owner — взять owner_id
+    из строки (импорт администратором), иначе владелец — user; строки с
+    несуществующим владельцем попадают в errors.
+    """
+    table = models.Link.__table__
+    report = {"created": 0, "overwritten": 0, "skipped": 0, "renamed": [], "errors": []}
+    rows: dict[str, tuple[int, dict]] = {}  # short_code -> (строка, значения)
+    to_generate: list[tuple[int, dict, str | None]] = []  # (строка, значения, исходный код)
+
+    if keep_owner:
+        # Иначе INSERT упадёт на внешнем ключе, а предыдущие пачки уже записаны
+        owner_ids = {item.owner_id for _, item in items if item.owner_id is not None}
+        known = set(db.scalars(select(models.User.id).where(models.User.id.in_(owner_ids)))) if owner_ids else set()
+        valid = []
+        for line, item in items:
+            if item.owner_id is None or item.owner_id in known:
+                valid.append((line, item))
+            else:
+                report["errors"].append({"line": line, "error": f"Пользователь {item.owner_id} не найден"})
+        items = valid
+
+    for line, item in items:
+        values = _import_values(item, item.owner_id if keep_owner else user.id)
+        short_code = item.short_code.strip() if item.short_code else None
+        if not short_code:
+            to_generate.append((line, values, None))
+        elif short_code not in rows or on_conflict == "overwrite":
+            rows[short_code] = (line, values)
+        elif on_conflict == "rename":
+            to_generate.append((line, values, short_code))
+        else:
+            report["skipped"] += 1
+
+    existing = set(db.scalars(select(models.Link.short_code).where(models.Link.short_code.in_(rows)))) if rows else set()
+    if on_conflict == "rename":
+        for short_code in existing:
+            line, values = rows.pop(short_code)
+            to_generate.append((line, values, short_code))
+
+    insert = dialect_insert(db.get_bind().dialect.name)
+    changed = []
+    overwritten = []
+
+    if rows:
+        stmt = insert(table).values([{**values, "short_code": code} for code, (_, values) in rows.items()])
+        if on_conflict == "overwrite":
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["short_code"],
+                set_={name: stmt.excluded[name] for name in next(iter(rows.values()))[1]},
+                # Чужие ссылки перезаписывает только администратор
+                where=None if keep_owner else table.c.owner_id == user.id,
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["short_code"])
+        written = set(db.scalars(stmt.returning(table.c.short_code)))
+        for short_code in rows:
+            if short_code not in written:
+                report["skipped"] += 1
+            else:
+                report["overwritten" if short_code in existing else "created"] += 1
+                changed.append(short_code)
+                if short_code in existing:
+                    overwritten.append(short_code)
+
+    while to_generate:
+        pending = dict(zip(shortcode.generate_many(len(to_generate)), to_generate))
+        stmt = (
+            insert(table)
+            .values([{**values, "short_code": code} for code, (_, values, _) in pending.items()])
+            .on_conflict_do_nothing(index_elements=["short_code"])
+            .returning(table.c.short_code)
+        )
+        written = set(db.scalars(stmt))
+        to_generate = []
+        for short_code, (line, values, original) in pending.items():
+            if short_code not in written:
+                to_generate.append((line, values, original))
+                continue
+            report["created"] += 1
+            changed.append(short_code)
+            if original:
+                report["renamed"].append({"line": line, "from": original, "to": short_code})
+
+    outbox.enqueue(db, overwritten)
+    db.commit()
+    # Новые коды: сбрасываем отрицательные записи кэша и добавляем коды в фильтр;
+    # перезаписанные ссылки сразу получают в кэше новое значение
+    cache.purge([short_code for short_code in changed if short_code not in existing])
+    outbox.sync(db, overwritten)
+    bloom.announce(changed)
+    mark_written(*_written_scopes(user.id, changed))
+    return report
+
+
+def get_link_by_short_code(db: Session, short_code: str) -> models.Link | None:
+    """Получение ссылки из БД (для изменения). Для чтения используйте get_link_record."""
     return db.query(models.Link).filter(models.Link.short_code == short_code).first()
 
 
-def delete_link(db: Session, short_code: str, user: models.User) -> models.Link | None:
-    """Удаление ссылки + очистка кэша"""
+async def get_link_by_short_code_async(db: AsyncSession, short_code: str) -> models.Link | None:
+    result = await db.execute(select(models.Link).where(models.Link.short_code == short_code))
+    return result.scalar_one_or_none()
+
+
+def get_user_by_username(db: Session, username: str) -> models.User | None:
+    return db.query(models.User).filter(models.User.username == username).first()
+
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> models.User | None:
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalar_one_or_none()
+
+
+def get_user_active(db: Session, user_id: int) -> bool:
+    return bool(db.scalar(select(models.User.is_active).where(models.User.id == user_id)))
+
+
+async def get_user_active_async(db: AsyncSession, user_id: int) -> bool:
+    return bool(await db.scalar(select(models.User.is_active).where(models.User.id == user_id)))
+
+
+def get_user_by_username_or_email(db: Session, username: str, email: str) -> models.User | None:
+    return db.query(models.User).filter(
+        (models.User.email == email) |
+        (models.User.username == username)
+    ).first()
+
+
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str) -> models.User:
+    db_user = models.User(
+        username=user.username,
+        email=user.email,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+
+def update_password_hash(db: Session, user_id: int, hashed_password: str) -> None:
+    db.query(models.User).filter(models.User.id == user_id).update({"hashed_password": hashed_password})
+    db.commit()
+
+
+def set_user_active(db: Session, user_id: int, is_active: bool) -> None:
+    """Активация/деактивация пользователя; кэш статуса сбрасывается во всех воркерах."""
+    db.query(models.User).filter(models.User.id == user_id).update({"is_active": is_active})
+    db.commit()
+    auth.evict_user(user_id)
+
+
+def get_link_record(db: Session, short_code: str) -> schemas.LinkRecord | None:
+    """Получение записи ссылки с кэшированием: при попадании в кэш SQL-запросов нет."""
+    record = cache.get_link_record(short_code)
+    if record is not None:
+        return record
+
+    link = get_link_by_short_code(db, short_code)
+    if link is None:
+        return None
+
+    record = schemas.LinkRecord.model_validate(link)
+    cache.set_link_record(record)
+    return record
+
+
+async def get_link_record_async(short_code: str) -> schemas.LinkRecord | None:
+    """Асинхронный вариант get_link_record: сессия БД открывается только при промахе кэша."""
+    record = await cache.get_link_record_async(short_code)
+    if record is not None:
+        return record
+
+    link = await run_db_read(
+        get_link_by_short_code, get_link_by_short_code_async, short_code, ryw=(f"link:{short_code}",)
+    )
+    if link is None:
+        return None
+
+    record = schemas.LinkRecord.model_validate(link)
+    await cache.set_link_record_async(record)
+    return record
+
+
+def delete_link(db: Session, short_code: str, user: schemas.UserClaims) -> models.Link | None:
+    """Удаление ссылки + отрицательная запись в кэше"""
     link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
     if not link:
         raise ValueError("Ссылка не найдена")
@@ -75,13 +470,107 @@ def delete_link(db: Session, short_code: str, user: models.User) -> models.Link
         raise ValueError("Нет прав")
 
     db.delete(link)
+    _delete_click_buckets(db, [short_code])
+    outbox.enqueue(db, [short_code])
     db.commit()
 
-    redis_client.delete(f"link:{short_code}")
+    # Отрицательная запись вместо удаления ключа: следующий редирект не идёт в БД
+    outbox.write_through(deleted=[short_code])
+    mark_written(*_written_scopes(link.owner_id, [short_code]))
     return link
 
-def get_user_links(db: Session, user_id: int) -> list[models.Link]:
-    return db.query(models.Link).filter(models.Link.owner_id == user_id).all()
+def _click_series_query(short_code: str, bucket_seconds: int, start: datetime, end: datetime):
+    bucket = models.LinkClickBucket
+    return (
+        select(bucket.bucket_start, bucket.clicks)
+        .where(
+            bucket.short_code == short_code,
+            bucket.bucket_seconds == bucket_seconds,
+            bucket.bucket_start >= start,
+            bucket.bucket_start < end,
+        )
+        .order_by(bucket.bucket_start)
+    )
+
+
+def get_click_series(db: Session, short_code: str, bucket_seconds: int, start: datetime, end: datetime) -> list[schemas.ClickBucket]:
+    """Непустые интервалы переходов за [start, end) — диапазон по первичному ключу таблицы."""
+    rows = db.execute(_click_series_query(short_code, bucket_seconds, start, end))
+    return [schemas.ClickBucket(start=row.bucket_start, clicks=row.clicks) for row in rows]
+
+
+async def get_click_series_async(db: AsyncSession, short_code: str, bucket_seconds: int, start: datetime, end: datetime) -> list[schemas.ClickBucket]:
+    rows = await db.execute(_click_series_query(short_code, bucket_seconds, start, end))
+    return [schemas.ClickBucket(start=row.bucket_start, clicks=row.clicks) for row in rows]
+
+
+def _delete_click_buckets(db: Session, short_codes: list[str]) -> None:
+    if short_codes:
+        db.execute(delete(models.LinkClickBucket).where(models.LinkClickBucket.short_code.in_(short_codes)))
+
+
+def delete_old_click_buckets(db: Session) -> int:
+    """Удаляет поминутные и почасовые интервалы старше срока хранения."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    deleted = 0
+    for bucket_seconds, retention in CLICK_BUCKET_RETENTION.items():
+        deleted += db.execute(
+            delete(models.LinkClickBucket).where(
+                models.LinkClickBucket.bucket_seconds == bucket_seconds,
+                models.LinkClickBucket.bucket_start < now - retention,
+            )
+        ).rowcount
+    db.commit()
+    return deleted
+
+
+def _user_links_page_query(
+    user_id: int,
+    limit: int,
+    after: tuple[datetime, int] | None = None,
+    expired: bool | None = None,
+    permanent: bool | None = None,
+    min_clicks: int | None = None,
+):
+    """Страница ссылок пользователя от новых к старым: keyset по индексу (owner_id, created_at, id)."""
+    link = models.Link
+    stmt = select(
+        link.id, link.short_code, link.original_url, link.created_at,
+        link.expires_at, link.is_permanent, link.clicks,
+    ).where(link.owner_id == user_id)
+
+    if after is not None:
+        created_at, link_id = after
+        stmt = stmt.where(
+            (link.created_at < created_at) | ((link.created_at == created_at) & (link.id < link_id))
+        )
+    if expired is not None:
+        now = datetime.now(timezone.utc)
+        is_expired = link.expires_at.is_not(None) & (link.expires_at <= now)
+        stmt = stmt.where(is_expired if expired else ~is_expired)
+    if permanent is not None:
+        stmt = stmt.where(link.is_permanent == permanent)
+    if min_clicks is not None:
+        stmt = stmt.where(link.clicks >= min_clicks)
+
+    # Лишняя строка показывает, есть ли следующая страница
+    return stmt.order_by(link.created_at.desc(), link.id.desc()).limit(limit + 1)
+
+
+def _links_page(rows, limit: int) -> tuple[list[schemas.LinkListItem], tuple[datetime, int] | None]:
+    rows = list(rows)
+    items = [schemas.LinkListItem.model_validate(row) for row in rows[:limit]]
+    after = (rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return items, after
+
+
+def get_user_links_page(db: Session, user_id: int, limit: int, **filters):
+    """Возвращает (ссылки, ключ следующей страницы или None)."""
+    return _links_page(db.execute(_user_links_page_query(user_id, limit, **filters)), limit)
+
+
+async def get_user_links_page_async(db: AsyncSession, user_id: int, limit: int, **filters):
+    return _links_page(await db.execute(_user_links_page_query(user_id, limit, **filters)), limit)
 
 def update_link(db: Session, short_code: str, new_url: str = None, expires_at: datetime = None) -> models.Link | None:
     """Обновление URL или срока жизни ссылки"""
@@ -92,50 +581,81 @@ def update_link(db: Session, short_code: str, new_url: str = None, expires_at: d
 
     if new_url:
         db_link.original_url = new_url
+        db_link.url_hash = models.url_hash(new_url)
 
     if expires_at:
         db_link.expires_at = expires_at  # ✅ Теперь срок истечения можно менять много раз
 
+    outbox.enqueue(db, [short_code])
     db.commit()
     db.refresh(db_link)
 
-    redis_client.delete(f"link:{short_code}")  # Очистка кэша
+    # Новое значение сразу в кэш (L1 остальных воркеров сбрасывается), без промаха после правки
+    outbox.write_through([schemas.LinkRecord.model_validate(db_link)])
+    mark_written(*_written_scopes(db_link.owner_id, [short_code]))
     return db_link
 
 
-def increment_clicks(db: Session, short_code: str) -> models.Link | None:
-    """Обновление счетчика переходов и времени последнего доступа."""
-    db_link = get_link_by_short_code(db, short_code)
-    if db_link:
-        db_link.clicks += 1
-        db_link.last_accessed = datetime.now(timezone.utc)
+def _delete_chunk(db: Session, condition, chunk_size: int) -> list[str]:
+    """Удаляет не больше chunk_size ссылок по условию одним DELETE ... RETURNING short_code."""
+    ids = select(models.Link.id).where(condition).limit(chunk_size)
+    if db.get_bind().dialect.name == "postgresql":
+        # Параллельная очистка на другом воркере пропускает уже заблокированные строки
+        ids = ids.with_for_update(skip_locked=True)
+
+    stmt = (
+        delete(models.Link)
+        .where(models.Link.id.in_(ids.scalar_subquery()))
+        .returning(models.Link.short_code)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        codes = list(db.execute(stmt).scalars())
+        _delete_click_buckets(db, codes)
         db.commit()
-        db.refresh(db_link)
-    return db_link
+    except Exception:
+        db.rollback()
+        raise
+    return codes
+
 
-def delete_expired_links(db: Session) -> None:
-    """Удаление:
+def delete_expired_links(db: Session, chunk_size: int = CLEANUP_CHUNK_SIZE) -> dict:
+    """Удаление пачками по chunk_size строк, каждая пачка — отдельная транзакция:
     1. Временных ссылок с истекшим сроком
     2. Ссылок без активности >7 дней
+    Удалённые коды вычищаются из Redis и учитываются фильтром кодов. Возвращает отчёт о скорости очистки.
     """
     now = datetime.now(MOSCOW_TZ)
-    
-    # Удаление по сроку действия
-    time_expired = db.query(models.Link).filter(
-        (models.Link.is_permanent == False) &
-        (models.Link.expires_at < now)
-    ).all()
-    
-    # Удаление по неактивности
-    inactive_links = db.query(models.Link).filter(
-        models.Link.last_accessed < (now - timedelta(days=7))
-    ).all()
-    
-    for link in time_expired + inactive_links:
-        db.delete(link)
-    
-    try:
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise
\ No newline at end of file
+    started = time.perf_counter()
+
+    conditions = (
+        # Удаление по сроку действия (индекс по expires_at)
+        (models.Link.is_permanent == False) & (models.Link.expires_at < now),
+        # Удаление по неактивности (индекс по last_accessed)
+        models.Link.last_accessed < (now - timedelta(days=INACTIVITY_DAYS)),
+    )
+
+    deleted = 0
+    for condition in conditions:
+        while True:
+            codes = _delete_chunk(db, condition, chunk_size)
+            cache.purge(codes)
+            # Иначе отстающая реплика успела бы вернуть удалённую ссылку в кэш
+            mark_written(*_written_scopes(None, codes))
+            deleted += len(codes)
+            if len(codes) < chunk_size:
+                break
+
+    bloom.note_deleted(deleted)
+    click_buckets_deleted = delete_old_click_buckets(db)
+
+    elapsed = time.perf_counter() - started
+    report = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "deleted": deleted,
+        "click_buckets_deleted": click_buckets_deleted,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(deleted / elapsed, 1) if elapsed > 0 else None,
+    }
+    cleanup_stats.update(report)
+    return report
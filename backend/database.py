@@ -1,7 +1,10 @@
+import asyncio
 import os
+import random
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env
@@ -12,12 +15,148 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in environment variables!")
 
+# Асинхронный путь запросов (async SQLAlchemy). ASYNC_DB=0 включает запасной
+# синхронный путь: запросы выполняются через SessionLocal в пуле потоков.
+ASYNC_DB = os.getenv("ASYNC_DB", "1") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# Реплики только для чтения (URL через запятую). Без них все запросы идут в основную БД
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Сколько секунд после записи чтения того же пользователя или ссылки идут в основную БД
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+
 engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+replica_engines = [create_engine(url) for url in DATABASE_REPLICA_URLS]
+
+routing_stats = {"replica": 0, "read_your_writes": 0}
+
+
+class RoutingSession(Session):
+    """Сессия, которая в режиме только для чтения (info["read_only"]) читает с реплики.
+
+    Реплика выбирается случайно один раз на сессию; запись (flush) всегда идёт
+    в основную БД.
+    """
+
+    primary = engine
+    replicas = replica_engines
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get("read_only") and self.replicas and not self._flushing:
+            replica = self.info.get("replica")
+            if replica is None:
+                replica = self.info["replica"] = random.choice(self.replicas)
+            return replica
+        return self.primary
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(
+    class_=RoutingSession, autocommit=False, autoflush=False, bind=engine, info={"read_only": True}
+)
+
+
+def _async_database_url(url: str) -> str:
+    """Подставляет асинхронный драйвер в URL базы данных."""
+    for prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            url = async_prefix + url[len(prefix):]
+            break
+    # asyncpg не понимает параметр libpq sslmode
+    return url.replace("sslmode=", "ssl=")
+
+
+def _create_async_engine(url: str):
+    async_url = _async_database_url(url)
+    pool_options = {} if async_url.startswith("sqlite") else {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+    }
+    return create_async_engine(async_url, **pool_options)
+
+
+if ASYNC_DB:
+    async_engine = _create_async_engine(DATABASE_URL)
+    async_replica_engines = [_create_async_engine(url) for url in DATABASE_REPLICA_URLS]
+
+    class AsyncRoutingSession(RoutingSession):
+        primary = async_engine.sync_engine
+        replicas = [replica.sync_engine for replica in async_replica_engines]
+
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, sync_session_class=AsyncRoutingSession, autoflush=False, expire_on_commit=False
+    )
+    AsyncReadSessionLocal = async_sessionmaker(
+        async_engine, sync_session_class=AsyncRoutingSession, autoflush=False, expire_on_commit=False,
+        info={"read_only": True},
+    )
+else:
+    async_engine = None
+    async_replica_engines = []
+    AsyncSessionLocal = None
+    AsyncReadSessionLocal = None
 
 Base = declarative_base()
 
+
+def dialect_insert(dialect_name: str):
+    """insert() с поддержкой ON CONFLICT для PostgreSQL или SQLite."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def run_db(sync_fn, async_fn=None, /, *args, **kwargs):
+    """Выполняет функцию crud с новой сессией БД.
+
+    В асинхронном режиме вызывается async_fn с AsyncSession, иначе sync_fn
+    с обычной сессией в отдельном потоке, чтобы не блокировать цикл событий.
+    """
+    if ASYNC_DB and async_fn is not None:
+        async with AsyncSessionLocal() as db:
+            return await async_fn(db, *args, **kwargs)
+
+    def call():
+        with SessionLocal() as db:
+            return sync_fn(db, *args, **kwargs)
+
+    return await asyncio.to_thread(call)
+
+
+async def run_db_read(sync_fn, async_fn=None, /, *args, ryw: tuple[str, ...] = (), **kwargs):
+    """run_db для запросов только на чтение: выполняется на реплике, если они настроены.
+
+    ryw — области (например, "user:1", "link:abc"), после записи в которые
+    чтение в течение READ_YOUR_WRITES_WINDOW секунд идёт в основную БД.
+    """
+    if not replica_engines:
+        return await run_db(sync_fn, async_fn, *args, **kwargs)
+    if ryw and await written_recently(*ryw):
+        routing_stats["read_your_writes"] += 1
+        return await run_db(sync_fn, async_fn, *args, **kwargs)
+
+    routing_stats["replica"] += 1
+    if ASYNC_DB and async_fn is not None:
+        async with AsyncReadSessionLocal() as db:
+            return await async_fn(db, *args, **kwargs)
+
+    def call():
+        with ReadSessionLocal() as db:
+            return sync_fn(db, *args, **kwargs)
+
+    return await asyncio.to_thread(call)
+
 import redis
+import redis.asyncio
 import os
 
 # Получаем URL Redis из переменных окружения
@@ -26,5 +165,63 @@ REDIS_URL = os.getenv("REDIS_URL")
 if not REDIS_URL:
     raise ValueError("❌ Переменная окружения REDIS_URL не установлена!")
 
-# Подключаемся к Redis
-redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+
+if REDIS_URL.startswith("memory://"):
+    # Redis в памяти процесса (fakeredis) — для бенчмарков и локального запуска без redis-server;
+    # fakeredis[lua] ставится из benchmarks/requirements.txt, в рабочем окружении его нет
+    import fakeredis
+    import fakeredis.aioredis
+
+    _fake_server = fakeredis.FakeServer()
+    redis_client = fakeredis.FakeRedis(server=_fake_server, decode_responses=True)
+    async_redis_client = redis.asyncio.Redis(
+        connection_pool=redis.asyncio.BlockingConnectionPool(
+            connection_class=fakeredis.aioredis.FakeConnection, server=_fake_server,
+            decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS, timeout=5,
+        )
+    )
+else:
+    # Подключаемся к Redis
+    redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+    # Асинхронный клиент для пути запросов: при исчерпании пула запрос ждёт
+    # свободное соединение, а не падает с ошибкой
+    async_redis_client = redis.asyncio.Redis(
+        connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+            REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS, timeout=5
+        )
+    )
+
+
+def _ryw_key(scope: str) -> str:
+    return f"ryw:{scope}"
+
+
+def mark_written(*scopes: str) -> None:
+    """Отмечает запись: чтения этих областей какое-то время идут в основную БД."""
+    if not replica_engines or not scopes:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for scope in scopes:
+        pipe.set(_ryw_key(scope), 1, px=int(READ_YOUR_WRITES_WINDOW * 1000))
+    pipe.execute()
+
+
+async def mark_written_async(*scopes: str) -> None:
+    if not replica_engines or not scopes:
+        return
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for scope in scopes:
+            pipe.set(_ryw_key(scope), 1, px=int(READ_YOUR_WRITES_WINDOW * 1000))
+        await pipe.execute()
+
+
+async def written_recently(*scopes: str) -> bool:
+    if not replica_engines or not scopes:
+        return False
+    return await async_redis_client.exists(*(_ryw_key(scope) for scope in scopes)) > 0
+
+
+def get_routing_stats() -> dict:
+    return {**routing_stats, "replicas": len(replica_engines), "read_your_writes_window": READ_YOUR_WRITES_WINDOW}
@@ -0,0 +1,121 @@
+"""Быстрый путь редиректа GET /{short_code}.
+
+ASGI-middleware перед роутером FastAPI: одиночный сегмент пути, не совпадающий
+со статическими маршрутами приложения, разрешается из кэша и сразу получает
+готовый ответ 307 — без разбора зависимостей, валидации и сборки Response.
+Сессия БД открывается только при промахе кэша. Обработчик redirect_to_original
+в main.py остаётся для OpenAPI и работает, если быстрый путь выключен
+(REDIRECT_FAST_PATH=0).
+"""
+import functools
+import os
+from urllib.parse import quote
+
+import bloom
+import cache
+import clicks
+import crud
+import models
+import ttl_policy
+from database import run_db_read
+
+REDIRECT_FAST_PATH = os.getenv("REDIRECT_FAST_PATH", "1") == "1"
+
+ROUTE_PATH = "/{short_code}"
+
+# Тот же набор безопасных символов, что у starlette.responses.RedirectResponse
+_LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+
+_NOT_FOUND_BODY = '{"detail":"Ссылка не найдена"}'.encode()
+_NOT_FOUND_START = {
+    "type": "http.response.start",
+    "status": 404,
+    "headers": [
+        (b"content-length", str(len(_NOT_FOUND_BODY)).encode()),
+        (b"content-type", b"application/json"),
+    ],
+}
+_NOT_FOUND_BODY_MESSAGE = {"type": "http.response.body", "body": _NOT_FOUND_BODY}
+_EMPTY_BODY_MESSAGE = {"type": "http.response.body", "body": b""}
+
+
+async def load_link(short_code: str) -> models.Link | None:
+    link = await run_db_read(
+        crud.get_link_by_short_code, crud.get_link_by_short_code_async, short_code, ryw=(f"link:{short_code}",)
+    )
+    if link is None:
+        bloom.record_false_positive(short_code)
+    return link
+
+
+async def resolve(short_code: str) -> str | None:
+    """Оригинальный URL по коду или None, если ссылки нет или она истекла."""
+    # Проверяем, есть ли в кэше (L1 в памяти процесса, затем Redis)
+    url = await cache.get_url_async(short_code, loader=load_link)
+    if url:
+        return url
+
+    # Отрицательная запись в кэше или кода нет в фильтре — в БД не идём
+    if url == "" or not bloom.might_contain(short_code):
+        return None
+
+    # Если нет, берем из БД и кэшируем; одновременные промахи ждут одну загрузку.
+    # Истёкшая ссылка, которую ещё не удалила очистка, тоже получает 404
+    return await cache.load_url(short_code, load_link)
+
+
+async def record_visit(short_code: str) -> None:
+    ttl_policy.touch(short_code)
+    await clicks.record_click_async(short_code)
+
+
+@functools.lru_cache(maxsize=4096)
+def _redirect_start(url: str) -> dict:
+    """Заголовки ответа 307 собираются один раз на URL."""
+    return {
+        "type": "http.response.start",
+        "status": 307,
+        "headers": [
+            (b"content-length", b"0"),
+            (b"location", quote(url, safe=_LOCATION_SAFE).encode("latin-1")),
+        ],
+    }
+
+
+class RedirectFastPath:
+    def __init__(self, app):
+        self.app = app
+        self._reserved: set[str] | None = None
+        self._route = None
+
+    def _init_routes(self, fastapi_app) -> None:
+        # Статические маршруты из одного сегмента (/ready, /metrics, /docs...) идут в роутер
+        self._reserved = {
+            route.path.strip("/") for route in fastapi_app.routes
+            if "{" not in route.path and route.path.count("/") == 1
+        }
+        self._route = next((route for route in fastapi_app.routes if route.path == ROUTE_PATH), None)
+
+    async def __call__(self, scope, receive, send):
+        if not REDIRECT_FAST_PATH or scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        short_code = scope["path"][1:]
+        if self._reserved is None:
+            self._init_routes(scope["app"])
+        if not short_code or "/" in short_code or short_code in self._reserved:
+            await self.app(scope, receive, send)
+            return
+
+        # Метка маршрута для метрик, как если бы запрос прошёл через роутер
+        scope["route"] = self._route
+        url = await resolve(short_code)
+        if url is None:
+            await send(_NOT_FOUND_START)
+            await send(_NOT_FOUND_BODY_MESSAGE)
+            return
+
+        await record_visit(short_code)
+        await send(_redirect_start(url))
+        await send(_EMPTY_BODY_MESSAGE)
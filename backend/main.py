@@ -1,23 +1,46 @@
 import asyncio
+import base64
+import csv
+import io
+import json
 import auth
-import crud, models, schemas
+import bloom
+import cache
+import clicks
+import crud, schemas
+import fastpath
+import logging
+import metrics
+import migrations
+import math
+import os
+import outbox
+import ratelimit
+import scheduler
+import ttl_policy
 import uvicorn
+import warmup
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
-from database import SessionLocal, engine
-from fastapi.responses import RedirectResponse
+import database
+from database import SessionLocal, engine, run_db, run_db_read
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from contextlib import asynccontextmanager
+from pydantic import ValidationError
 from schemas import *
-from database import redis_client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from typing import Literal
 
 
+logger = logging.getLogger(__name__)
+
 print("🚀 FastAPI успешно запущен!")
 
-models.Base.metadata.create_all(bind=engine)
+# Миграции при запуске воркера. С AUTO_MIGRATE=0 схема обновляется отдельным
+# шагом развёртывания (python migrations.py), и воркер стартует без запросов к БД
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
 
 # SECRET_KEY = "your-secret-key"
 # ALGORITHM = "HS256"
@@ -27,23 +50,44 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Код выполняется при запуске приложения
-    with SessionLocal() as db:
-        crud.delete_expired_links(db)
-    
-    # Запускаем фоновую задачу
-    task = asyncio.create_task(periodic_cleanup())
+    if AUTO_MIGRATE:
+        # Не при импорте, чтобы импорт main не обращался к БД
+        await asyncio.to_thread(migrations.run_migrations)
+
+    # Подписываемся на инвалидацию L1-кэша
+    invalidation_listener = cache.InvalidationListener()
+    invalidation_listener.start()
+
+    # Запускаем фоновые задачи (первая очистка выполняется сразу при запуске,
+    # прогрев кэша — в отдельном потоке, до его завершения /ready отвечает 503)
+    scheduler.start()
     
     yield  # Здесь приложение работает
     
     # Код выполняется при завершении работы
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    await scheduler.stop()
 
-app = FastAPI()
+    invalidation_listener.stop()
+    auth.shutdown_hash_pool()
+
+    # Дописываем накопленные переходы, чтобы не ждать следующего воркера
+    await asyncio.to_thread(clicks.flush_clicks)
+
+    await database.async_redis_client.aclose()
+    for async_engine in filter(None, [database.async_engine, *database.async_replica_engines]):
+        await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+# Быстрый путь редиректа внутри метрик, чтобы его задержки тоже учитывались
+app.add_middleware(fastpath.RedirectFastPath)
+app.add_middleware(metrics.MetricsMiddleware)
+
+for db_engine in [engine, *database.replica_engines]:
+    metrics.instrument_engine(db_engine)
+for db_engine in filter(None, [database.async_engine, *database.async_replica_engines]):
+    metrics.instrument_engine(db_engine.sync_engine)
+metrics.instrument_redis(database.redis_client)
+metrics.instrument_redis(database.async_redis_client, is_async=True)
 
 def get_db():
     db = SessionLocal()
@@ -52,36 +96,65 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+async def get_current_user(
     token: Optional[str] = None,
-    db: Session = Depends(get_db)
-) -> Optional[models.User]:
+    bearer_token: Optional[str] = Depends(oauth2_scheme_optional),
+) -> Optional[schemas.UserClaims]:
+    """Пользователь из токена (параметр token или заголовок Authorization: Bearer).
+
+    Токен и статус активности кэшируются, поэтому обычно запрос обходится без БД.
+    """
+    token = token or bearer_token
     if not token:  
         return None  # ✅ Теперь анонимный пользователь поддерживается
 
-    try:
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            return None
-    except (JWTError, KeyError, TypeError): 
+    claims = await auth.verify_token(token)
+    if claims is None:
         return None
 
-    return db.query(models.User).filter(models.User.username == username).first()
+    if claims.id is None:
+        # Старый токен без ID пользователя: один раз ищем по имени
+        user = await run_db(crud.get_user_by_username, crud.get_user_by_username_async, claims.username)
+        if user is None:
+            return None
+        claims = claims.model_copy(update={"id": user.id})
+        auth.cache_claims(token, claims)
+
+    is_active = auth.get_cached_user_active(claims.id)
+    if is_active is None:
+        is_active = await run_db(crud.get_user_active, crud.get_user_active_async, claims.id)
+        auth.cache_user_active(claims.id, is_active)
+
+    return claims if is_active else None
 
 
+def rate_limit(route: str):
+    """Зависимость: лимит запросов маршрута на пользователя, для анонимных — на IP."""
+    async def dependency(
+        request: Request,
+        response: Response,
+        current_user: Optional[schemas.UserClaims] = Depends(get_current_user),
+    ):
+        await ratelimit.check(route, request, response, current_user.id if current_user else None)
+    return dependency
 
 
+def require_user(current_user: Optional[schemas.UserClaims] = Depends(get_current_user)) -> schemas.UserClaims:
+    if current_user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Требуется авторизация")
+    return current_user
 
-@app.post("/links/shorten", response_model=schemas.Link)
-def create_short_link(
+
+@app.post("/links/shorten", response_model=schemas.Link, dependencies=[Depends(rate_limit("shorten"))])
+async def create_short_link(
     link: schemas.LinkCreate,
-    db: Session = Depends(get_db),
-    current_user: Optional[models.User] = Depends(get_current_user)
+    current_user: Optional[schemas.UserClaims] = Depends(get_current_user)
 ):
     try:
         # Попытка создания ссылки
-        return crud.create_link(db, link, user=current_user)
+        return await run_db(crud.create_link, crud.create_link_async, link, user=current_user)
     except ValueError as e:
         # Обработка случая, когда короткий код уже существует
         if "уже существует" in str(e):
@@ -97,31 +170,266 @@ def create_short_link(
 
 
 
-@app.get("/{short_code}")
-def redirect_to_original(short_code: str, db: Session = Depends(get_db)):
-    """Перенаправление по короткой ссылке с кэшированием"""
+BATCH_MAX_ITEMS = 100_000
+
+
+def parse_batch(body: bytes, content_type: str) -> list[tuple[int, schemas.LinkCreate | None, str | None]]:
+    """Разбор тела пакетного запроса: JSON-массив или NDJSON (по объекту LinkCreate в строке)."""
+    if "ndjson" in content_type:
+        raw_items = []
+        for line in body.decode().splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raw_items.append(e)
+    else:
+        try:
+            raw_items = json.loads(body)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Ожидается JSON-массив или NDJSON")
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="Ожидается JSON-массив или NDJSON")
+
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Не больше {BATCH_MAX_ITEMS} ссылок за запрос")
+
+    items = []
+    for index, raw in enumerate(raw_items):
+        if isinstance(raw, Exception):
+            items.append((index, None, f"Некорректный JSON: {raw}"))
+            continue
+        try:
+            items.append((index, schemas.LinkCreate.model_validate(raw), None))
+        except ValidationError as e:
+            items.append((index, None, e.errors()[0]["msg"]))
+    return items
+
+
+@app.post("/links/shorten/batch", dependencies=[Depends(rate_limit("shorten_batch"))])
+async def create_short_links_batch(
+    request: Request,
+    current_user: Optional[schemas.UserClaims] = Depends(get_current_user)
+):
+    """Пакетное создание ссылок. Результат — NDJSON по одной строке на элемент, в порядке запроса."""
+    items = parse_batch(await request.body(), request.headers.get("content-type", ""))
+
+    async def results():
+        for start in range(0, len(items), crud.BATCH_CHUNK_SIZE):
+            chunk = items[start:start + crud.BATCH_CHUNK_SIZE]
+            lines = {index: {"index": index, "error": error} for index, _, error in chunk if error}
+            valid = [(index, link) for index, link, error in chunk if not error]
+            try:
+                created = await run_db(crud.create_links_chunk, None, valid, user=current_user)
+            except Exception:
+                logger.exception("Ошибка при пакетном создании ссылок")
+                created = [(index, None, "Внутренняя ошибка") for index, _ in valid]
+
+            for index, record, error in created:
+                if error:
+                    lines[index] = {"index": index, "error": error}
+                else:
+                    lines[index] = {"index": index, "link": record.model_dump(mode="json", exclude={"owner_id"})}
+            yield "".join(json.dumps(lines[index], ensure_ascii=False) + "\n" for index in sorted(lines))
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/ready", include_in_schema=False)
+def readiness():
+    """Готовность для балансировщика: 503, пока не прогрета доля WARMUP_READY_FRACTION кэша"""
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if warmup.is_ready() else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": warmup.is_ready(), "warmup": warmup.state},
+    )
 
-    # Проверяем, есть ли в кэше
-    cached_url = redis_client.get(f"link:{short_code}")
-    if cached_url:
-        print(f"✅ Кэш найден для {short_code}")
-        return RedirectResponse(url=cached_url)
 
-    # Если нет, берем из БД и кэшируем
-    link = crud.get_link_by_short_code(db, short_code)
-    if link is None:
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/{short_code}")
+async def redirect_to_original(short_code: str):
+    """Перенаправление по короткой ссылке с кэшированием.
+
+    Обычно запрос обслуживает fastpath.RedirectFastPath, не доходя до роутера.
+    """
+    url = await fastpath.resolve(short_code)
+    if url is None:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
-    redis_client.setex(f"link:{short_code}", 3600, link.original_url)
-    return RedirectResponse(url=link.original_url)
+    await fastpath.record_visit(short_code)
+    return RedirectResponse(url=url)
+
+USER_LINKS_MAX_LIMIT = 500
+
+
+def encode_cursor(after: tuple[datetime, int]) -> str:
+    created_at, link_id = after
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), link_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, link_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(link_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+@app.get("/users/me/links", response_model=schemas.LinkPage)
+async def list_my_links(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    expired: Optional[bool] = None,
+    permanent: Optional[bool] = None,
+    min_clicks: Optional[int] = None,
+    current_user: schemas.UserClaims = Depends(require_user),
+):
+    """Ссылки пользователя от новых к старым. Следующая страница — с cursor=next_cursor"""
+    if not 1 <= limit <= USER_LINKS_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {USER_LINKS_MAX_LIMIT}")
+
+    items, after = await run_db_read(
+        crud.get_user_links_page, crud.get_user_links_page_async, current_user.id, limit,
+        ryw=(f"user:{current_user.id}",),
+        after=decode_cursor(cursor) if cursor else None,
+        expired=expired, permanent=permanent, min_clicks=min_clicks,
+    )
+    return schemas.LinkPage(items=items, next_cursor=encode_cursor(after) if after else None)
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_ndjson(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps({name: _export_value(value) for name, value in row.items()}, ensure_ascii=False) + "\n"
+            for row in batch
+        )
+
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(crud.EXPORT_FIELDS)
+    for batch in batches:
+        for row in batch:
+            writer.writerow(["" if row[name] is None else _export_value(row[name]) for name in crud.EXPORT_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@app.get("/links/export")
+async def export_links(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    scope: Literal["mine", "all"] = "mine",
+    current_user: schemas.UserClaims = Depends(require_user),
+):
+    """Потоковая выгрузка ссылок пользователя (scope=all — всех, только для ADMIN_USERS)"""
+    if scope == "all" and not auth.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Выгрузка всех ссылок доступна только администраторам")
+
+    # Синхронный генератор: StreamingResponse читает его в пуле потоков пачка за пачкой
+    read_only = not await database.written_recently(f"user:{current_user.id}")
+    batches = crud.iter_links_for_export(None if scope == "all" else current_user.id, read_only=read_only)
+    body, media_type = (export_csv(batches), "text/csv") if format == "csv" else (export_ndjson(batches), "application/x-ndjson")
+    return StreamingResponse(
+        body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="links.{format}"'}
+    )
+
+
+IMPORT_REPORT_LIMIT = 1000
+
+
+async def iter_lines(stream):
+    """Строки тела запроса по мере поступления, без чтения тела целиком."""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode().rstrip("\r")
+    if buffer:
+        yield buffer.decode().rstrip("\r")
+
+
+@app.post("/links/import")
+async def import_links(
+    request: Request,
+    on_conflict: Literal["skip", "overwrite", "rename"] = "skip",
+    current_user: schemas.UserClaims = Depends(require_user),
+):
+    """Импорт ссылок из NDJSON или CSV (формат GET /links/export) пачками по BATCH_CHUNK_SIZE.
+
+    Тело читается потоком. В ответе — число созданных, перезаписанных и пропущенных
+    ссылок, новые коды переименованных (on_conflict=rename) и ошибки разбора строк
+    (и строк с несуществующим owner_id при импорте администратором).
+    """
+    is_csv = "csv" in request.headers.get("content-type", "")
+    keep_owner = auth.is_admin(current_user)
+    report = {"created": 0, "overwritten": 0, "skipped": 0, "renamed": [], "errors": [], "truncated": False}
+
+    def add_to_report(part: dict) -> None:
+        for key in ("created", "overwritten", "skipped"):
+            report[key] += part[key]
+        for key in ("renamed", "errors"):
+            room = IMPORT_REPORT_LIMIT - len(report[key])
+            report[key].extend(part[key][:room])
+            report["truncated"] |= len(part[key]) > room
+
+    async def flush(chunk):
+        if chunk:
+            add_to_report(await run_db(
+                crud.import_links_chunk, None, chunk, current_user, on_conflict=on_conflict, keep_owner=keep_owner
+            ))
+
+    header = None
+    chunk = []
+    line_number = 0
+    async for line in iter_lines(request.stream()):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            if is_csv:
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = values
+                    continue
+                raw = {name: value or None for name, value in zip(header, values)}
+            else:
+                raw = json.loads(line)
+            chunk.append((line_number, schemas.LinkImport.model_validate(raw)))
+        except (ValueError, ValidationError) as e:
+            if len(report["errors"]) < IMPORT_REPORT_LIMIT:
+                report["errors"].append({"line": line_number, "error": str(e).splitlines()[0]})
+            else:
+                report["truncated"] = True
+            continue
+
+        if len(chunk) >= crud.BATCH_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+    await flush(chunk)
+    return report
+
 
 @app.delete("/links/{short_code}")
 def delete_short_link(
     short_code: str,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)  # Авторизация обязательна
+    current_user: schemas.UserClaims = Depends(require_user)  # Авторизация обязательна
 ):
-    link = crud.get_link_by_short_code(db, short_code)
+    link = crud.get_link_record(db, short_code)
     if link is None:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
     
@@ -132,14 +440,14 @@ def delete_short_link(
     return {"message": "Ссылка удалена"}
 
 
-@app.put("/links/{short_code}")
+@app.put("/links/{short_code}", response_model=schemas.Link)
 def update_short_link(
     short_code: str,
     original_url: str,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)  # Авторизация обязательна
+    current_user: schemas.UserClaims = Depends(require_user)  # Авторизация обязательна
 ):
-    link = crud.get_link_by_short_code(db, short_code)
+    link = crud.get_link_record(db, short_code)
     if link is None:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
@@ -150,66 +458,130 @@ def update_short_link(
     return updated_link
 
 
-@app.get("/links/{short_code}/stats", response_model=schemas.Link)
-def get_link_stats(short_code: str, db: Session = Depends(get_db)):
-    return crud.get_link_by_short_code(db, short_code) or HTTPException(status_code=404, detail="Ссылка не найдена")
+# Диапазон ряда по умолчанию и ограничение на число интервалов в ответе
+SERIES_DEFAULT_RANGE = {"minute": timedelta(hours=2), "hour": timedelta(days=7), "day": timedelta(days=365)}
+SERIES_MAX_POINTS = 2000
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+@app.get("/links/{short_code}/stats", response_model=schemas.LinkStats)
+async def get_link_stats(
+    short_code: str,
+    series: Optional[Literal["minute", "hour", "day"]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Статистика ссылки; с series — ещё и число переходов по интервалам за [start, end) (UTC)"""
+    link = await crud.get_link_record_async(short_code)
+    if link is None:
+        raise HTTPException(status_code=404, detail="Ссылка не найдена")
+
+    stats = schemas.LinkStats.model_validate(link.model_dump())
+    if series:
+        end = to_utc_naive(end) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+        start = to_utc_naive(start) if start else end - SERIES_DEFAULT_RANGE[series]
+        bucket_seconds = clicks.SERIES_BUCKETS[series]
+        if start >= end:
+            raise HTTPException(status_code=400, detail="start должен быть раньше end")
+        if (end - start).total_seconds() / bucket_seconds > SERIES_MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"Не больше {SERIES_MAX_POINTS} интервалов за запрос")
+        stats.series = await run_db_read(
+            crud.get_click_series, crud.get_click_series_async, short_code, bucket_seconds, start, end
+        )
+    return stats
 
 
 
 @app.get("/links/{short_code}/original")
-def get_original_url(short_code: str, db: Session = Depends(get_db)):
+async def get_original_url(short_code: str):
     """Находит оригинальный URL по короткому коду."""
-    link = crud.get_link_by_short_code(db, short_code)
+    link = await crud.get_link_record_async(short_code)
     if not link:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
     return {"original_url": link.original_url}
 
 
 
+@app.exception_handler(auth.HashingOverloaded)
+async def hashing_overloaded_handler(request: Request, exc: auth.HashingOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Сервер перегружен, повторите попытку позже"},
+        headers={"Retry-After": str(auth.PASSWORD_HASH_RETRY_AFTER)},
+    )
+
+
+@app.exception_handler(ratelimit.RateLimited)
+async def rate_limited_handler(request: Request, exc: ratelimit.RateLimited):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Слишком много запросов, повторите попытку позже"},
+        headers={
+            "Retry-After": str(max(1, math.ceil(exc.retry_after))),
+            "X-RateLimit-Limit": str(exc.limit),
+            "X-RateLimit-Remaining": "0",
+        },
+    )
+
+
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(models.User).filter(
-        (models.User.email == user.email) |
-        (models.User.username == user.username)
-    ).first()
+async def register(user: schemas.UserCreate, request: Request, response: Response):
+    await ratelimit.check("register", request, response)
+    existing_user = await run_db(crud.get_user_by_username_or_email, None, user.username, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists")
     
-    hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(
-        username=user.username,
-        email=user.email,
-        hashed_password=hashed_password
-    )
-    db.add(db_user)
-    db.commit()
-    return db_user
+    hashed_password = await auth.hash_password(user.password)
+    return await run_db(crud.create_user, None, user, hashed_password)
 
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(
-        models.User.username == form_data.username
-    ).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login(request: Request, response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
+    await ratelimit.check("token", request, response)
+    user = await run_db(crud.get_user_by_username, crud.get_user_by_username_async, form_data.username)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+    verified, new_hash = await auth.verify_and_update_password(form_data.password, user.hashed_password)
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials"
+        )
+    if new_hash:
+        # passlib сообщил, что хэш устарел: сохраняем пересчитанный в пуле
+        await run_db(crud.update_password_hash, None, user.id, new_hash)
     return {
-        "access_token": auth.create_access_token({"sub": user.username}),
+        "access_token": auth.create_access_token({"sub": user.username, "uid": user.id}),
         "token_type": "bearer"
     }
 
+@app.post("/logout")
+async def logout(
+    token: Optional[str] = None,
+    bearer_token: Optional[str] = Depends(oauth2_scheme_optional),
+):
+    """Отзыв токена: он сразу перестаёт приниматься всеми воркерами."""
+    token = token or bearer_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Требуется авторизация")
+    await auth.revoke_token(token)
+    return {"message": "Токен отозван"}
+
 @app.post("/links/{short_code}/set_expiry")
 def set_link_expiry(
     short_code: str,
     data: LinkExpiryUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Optional[schemas.UserClaims] = Depends(get_current_user)
 ):
     expires_at = data.expires_at
 
-    link = crud.get_link_by_short_code(db, short_code)
+    link = crud.get_link_record(db, short_code)
     if not link:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
@@ -219,24 +591,57 @@ def set_link_expiry(
 
     expires_at = expires_at.replace(tzinfo=None)
 
-    # Обновляем дату истечения
-    link.expires_at = expires_at
-    db.commit()
-    db.refresh(link)
-
-    # Удаляем старый кэш в Redis
-    redis_client.delete(f"link:{short_code}")
+    # Обновляем дату истечения (update_link сразу записывает новое значение в кэш)
+    crud.update_link(db, short_code, expires_at=expires_at)
 
     return {"message": "Срок действия ссылки обновлен", "expires_at": expires_at}
 
 
 
-async def periodic_cleanup():
-    """Периодическая очистка каждые 5 минут"""
-    while True:
-        await asyncio.sleep(300)  # 5 минут
-        with SessionLocal() as db:
-            crud.delete_expired_links(db)
+@app.get("/system/stats")
+def get_system_stats():
+    """Состояние фоновых процессов и кэша: запись переходов, попадания по уровням кэша, последняя очистка, очередь хэширования паролей, фильтр кодов, прогрев кэша, уровни TTL кэша ссылок, фоновые задачи, запись изменений ссылок в кэш."""
+    return {
+        "clicks": clicks.get_stats(),
+        "cache": cache.get_stats(),
+        "cleanup": crud.cleanup_stats,
+        "password_hashing": auth.hash_pool_stats(),
+        "bloom": bloom.get_stats(),
+        "warmup": warmup.state,
+        "ttl_policy": ttl_policy.get_stats(),
+        "scheduler": scheduler.get_stats(),
+        "database": database.get_routing_stats(),
+        "rate_limit": ratelimit.get_stats(),
+        "cache_outbox": outbox.get_stats(),
+    }
+
+
+# Очистка устаревших ссылок: раз в CLEANUP_INTERVAL секунд на весь кластер
+CLEANUP_INTERVAL = float(os.getenv("CLEANUP_INTERVAL", "300"))
+CLEANUP_TIMEOUT = float(os.getenv("CLEANUP_TIMEOUT", "900"))
+
+
+def run_cleanup() -> dict:
+    with SessionLocal() as db:
+        report = crud.delete_expired_links(db)
+    logger.info("Очистка: удалено %s ссылок, %s строк/с", report["deleted"], report["rows_per_sec"])
+    return report
+
+
+def register_jobs() -> None:
+    """Фоновые задачи: прогрев — в каждом воркере (Redis прогревает один, см. warmup.py), остальное — в одном воркере кластера."""
+    scheduler.add_job("warmup", warmup.run, timeout=None, leader_only=False)
+    scheduler.add_job("cleanup", run_cleanup, interval=CLEANUP_INTERVAL, timeout=CLEANUP_TIMEOUT)
+    scheduler.add_job(
+        "click_flush", clicks.flush_clicks,
+        interval=clicks.CLICK_FLUSH_INTERVAL, timeout=max(60, clicks.CLICK_FLUSH_INTERVAL * 6),
+    )
+    scheduler.add_job("cache_sweep", ttl_policy.sweep, interval=ttl_policy.LINK_CACHE_SWEEP_INTERVAL, timeout=120)
+    scheduler.add_job("cache_outbox", outbox.relay, interval=outbox.CACHE_OUTBOX_INTERVAL, timeout=60)
+    scheduler.add_job("cache_reconcile", outbox.reconcile, interval=outbox.CACHE_RECONCILE_INTERVAL, timeout=600)
+
+
+register_jobs()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000, log_level="debug")
@@ -0,0 +1,270 @@
+"""Метрики Prometheus: задержки запросов, SQL и Redis, состояние кэша и фоновых задач.
+
+Запись на пути запроса — несколько наблюдений гистограмм без блокирующего ввода-вывода;
+счётчики кэша, переходов и очистки читаются из уже существующих словарей статистики
+только в момент выгрузки (GET /metrics).
+"""
+import functools
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+import auth
+import bloom
+import cache
+import clicks
+import crud
+import outbox
+import ratelimit
+import scheduler
+import ttl_policy
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения SQL-запроса",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+redis_command_duration = Histogram(
+    "redis_command_duration_seconds",
+    "Время выполнения команды Redis",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма задержек по шаблону маршрута (/{short_code}, а не по коду)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Маршрут выставляет роутер Starlette; без совпадения — одна общая метка
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            http_request_duration.labels(scope["method"], route, str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip()[:6].upper()
+
+
+def instrument_engine(engine) -> None:
+    """Счётчик и длительность SQL-запросов через события SQLAlchemy."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.labels(_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        stack = context.connection.info.get("query_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+
+def instrument_redis(client, is_async: bool = False) -> None:
+    """Оборачивает команды клиента Redis (и выполнение его pipeline) в замер времени."""
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    if is_async:
+        @functools.wraps(execute_command)
+        async def timed_command(*args, **options):
+            started = time.perf_counter()
+            try:
+                return await execute_command(*args, **options)
+            finally:
+                redis_command_duration.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+        def timed_pipeline(*args, **kwargs):
+            pipe = make_pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            async def timed_execute(*a, **kw):
+                started = time.perf_counter()
+                try:
+                    return await execute(*a, **kw)
+                finally:
+                    redis_command_duration.labels("PIPELINE").observe(time.perf_counter() - started)
+
+            pipe.execute = timed_execute
+            return pipe
+    else:
+        @functools.wraps(execute_command)
+        def timed_command(*args, **options):
+            started = time.perf_counter()
+            try:
+                return execute_command(*args, **options)
+            finally:
+                redis_command_duration.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+        def timed_pipeline(*args, **kwargs):
+            pipe = make_pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def timed_execute(*a, **kw):
+                started = time.perf_counter()
+                try:
+                    return execute(*a, **kw)
+                finally:
+                    redis_command_duration.labels("PIPELINE").observe(time.perf_counter() - started)
+
+            pipe.execute = timed_execute
+            return pipe
+
+    client.execute_command = timed_command
+    client.pipeline = timed_pipeline
+
+
+class StatsCollector:
+    """Выгружает существующие словари статистики (кэш, переходы, очистка) при каждом опросе."""
+
+    def collect(self):
+        hits = CounterMetricFamily("link_cache_hits", "Попадания в кэш ссылок", labels=["tier"])
+        misses = CounterMetricFamily("link_cache_misses", "Промахи кэша ссылок", labels=["tier"])
+        for tier, counters in cache.tier_stats.items():
+            hits.add_metric([tier], counters["hits"])
+            misses.add_metric([tier], counters["misses"])
+        yield hits
+        yield misses
+        yield GaugeMetricFamily("link_cache_l1_size", "Записей в L1-кэше воркера", value=len(cache.l1))
+        stampede = CounterMetricFamily("link_cache_stampede", "Загрузки ссылок при промахах кэша", labels=["event"])
+        for name, value in cache.stampede_stats.items():
+            stampede.add_metric([name], value)
+        yield stampede
+
+        tier_hits = CounterMetricFamily("link_cache_tier_hits", "Попадания в кэш ссылок по уровням TTL", labels=["tier"])
+        tier_misses = CounterMetricFamily("link_cache_tier_misses", "Промахи кэша ссылок по уровням TTL", labels=["tier"])
+        tier_bytes = GaugeMetricFamily("link_cache_tier_bytes", "Объём кэша ссылок в Redis (link:* и linkrec:*) по уровням TTL", labels=["tier"])
+        tier_keys = GaugeMetricFamily("link_cache_tier_keys", "Ключей link:* в Redis по уровням TTL", labels=["tier"])
+        for tier, counters in ttl_policy.stats["tiers"].items():
+            tier_hits.add_metric([tier], counters["hits"])
+            tier_misses.add_metric([tier], counters["misses"])
+            tier_bytes.add_metric([tier], ttl_policy.stats["memory"][tier]["bytes"])
+            tier_keys.add_metric([tier], ttl_policy.stats["memory"][tier]["keys"])
+        yield tier_hits
+        yield tier_misses
+        yield tier_bytes
+        yield tier_keys
+        yield CounterMetricFamily(
+            "link_cache_evicted", "Ключей link:* вытеснено сверх LINK_CACHE_MAX_BYTES", value=ttl_policy.stats["evicted_total"]
+        )
+
+        write_through = CounterMetricFamily(
+            "link_cache_write_through", "Записи изменённых ссылок в кэш после коммита", labels=["result"]
+        )
+        write_through.add_metric(["ok"], outbox.stats["written"])
+        write_through.add_metric(["failed"], outbox.stats["failed"])
+        yield write_through
+        yield CounterMetricFamily(
+            "link_cache_outbox_relayed", "Изменений, повторно записанных в кэш из outbox", value=outbox.stats["relayed"]
+        )
+        yield GaugeMetricFamily(
+            "link_cache_outbox_pending", "Строк в outbox после последнего запуска", value=outbox.stats["pending"]
+        )
+        yield CounterMetricFamily(
+            "link_cache_drift", "Расхождений кэша с БД, исправленных сверкой", value=outbox.stats["drift"]
+        )
+
+        yield CounterMetricFamily(
+            "clicks_flushed", "Переходов записано в БД", value=clicks.stats["flushed_clicks_total"]
+        )
+        yield CounterMetricFamily(
+            "clicks_flush_errors", "Ошибок записи переходов", value=clicks.stats["flush_errors_total"]
+        )
+        if clicks.stats["last_flush_lag_seconds"] is not None:
+            yield GaugeMetricFamily(
+                "clicks_flush_lag_seconds", "Отставание последней записи переходов",
+                value=clicks.stats["last_flush_lag_seconds"],
+            )
+
+        report = crud.cleanup_stats
+        if report.get("finished_at"):
+            yield GaugeMetricFamily("cleanup_last_deleted", "Удалено ссылок последней очисткой", value=report["deleted"])
+            yield GaugeMetricFamily("cleanup_last_duration_seconds", "Длительность последней очистки", value=report["seconds"])
+            yield GaugeMetricFamily(
+                "cleanup_last_rows_per_second", "Скорость последней очистки", value=report["rows_per_sec"] or 0
+            )
+
+        yield CounterMetricFamily(
+            "bloom_absent", "Коды, отсечённые фильтром Блума без запроса к БД", value=bloom.stats["absent"]
+        )
+        yield CounterMetricFamily(
+            "bloom_false_positives", "Коды, пропущенные фильтром, которых нет в БД", value=bloom.stats["false_positives"]
+        )
+        bloom_stats = bloom.get_stats()
+        if bloom_stats["false_positive_rate"] is not None:
+            yield GaugeMetricFamily(
+                "bloom_false_positive_rate", "Доля ложных срабатываний фильтра среди несуществующих кодов",
+                value=bloom_stats["false_positive_rate"],
+            )
+        yield GaugeMetricFamily("bloom_items", "Кодов в фильтре Блума", value=bloom_stats["items"])
+
+        job_runs = CounterMetricFamily("scheduler_job_runs", "Запуски фоновых задач", labels=["job", "status"])
+        job_duration = GaugeMetricFamily(
+            "scheduler_job_last_duration_seconds", "Длительность последнего запуска фоновой задачи", labels=["job"]
+        )
+        for name, state in scheduler.get_stats()["jobs"].items():
+            job_runs.add_metric([name, "failed"], state["failures"])
+            job_runs.add_metric([name, "timeout"], state["timeouts"])
+            job_runs.add_metric([name, "ok"], state["runs"] - state["failures"] - state["timeouts"])
+            job_runs.add_metric([name, "skipped"], state["skipped"])
+            if state["last_duration_seconds"] is not None:
+                job_duration.add_metric([name], state["last_duration_seconds"])
+        yield job_runs
+        yield job_duration
+
+        rate_limited = CounterMetricFamily(
+            "rate_limit_requests", "Проверки лимита запросов", labels=["route", "result"]
+        )
+        for route, counters in ratelimit.stats.items():
+            for result, value in counters.items():
+                rate_limited.add_metric([route, result], value)
+        yield rate_limited
+
+        yield GaugeMetricFamily(
+            "password_hash_waiting", "Запросов в очереди хэширования паролей", value=auth.hash_pool_stats()["waiting"]
+        )
+
+
+REGISTRY.register(StatsCollector())
@@ -0,0 +1,172 @@
+"""Миграции схемы БД.
+
+create_all создаёт только отсутствующие таблицы, поэтому изменения уже
+существующих таблиц и начальные данные применяются здесь. Разовые миграции
+выполняются по порядку и отмечаются в таблице schema_migrations; недостающие
+индексы из моделей досоздаются при каждом запуске.
+
+После успешного прогона в schema_migrations записывается отпечаток схемы
+моделей; если он уже есть, запуск ограничивается одним SELECT и не проверяет
+каждую таблицу и индекс. Запуск вручную (всегда полный): python migrations.py
+
+Проверки вида «есть ли столбец или индекс» и следующие за ними ALTER/CREATE не
+атомарны, поэтому прогон целиком выполняется под блокировкой: pg_advisory_lock
+в PostgreSQL, блокировка файла рядом с базой в SQLite. Воркеры, запущенные
+одновременно, выполняют миграции по очереди.
+"""
+import hashlib
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: локальная SQLite обычно используется одним процессом
+    fcntl = None
+
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+import models
+from database import dialect_insert, engine
+
+BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+# Ключ pg_advisory_lock для миграций
+MIGRATION_LOCK_ID = 7_246_031
+
+
+def create_missing_indexes(bind: Engine) -> None:
+    """Создаёт индексы, объявленные в моделях, которых ещё нет в БД."""
+    with bind.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def seed_short_code_counter(bind: Engine) -> None:
+    """Создаёт единственную строку счётчика коротких кодов."""
+    insert = dialect_insert(bind.dialect.name)
+    with bind.begin() as conn:
+        conn.execute(
+            insert(models.ShortCodeCounter.__table__)
+            .values(id=1, next_value=0)
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+
+
+def add_links_url_hash(bind: Engine) -> None:
+    """Добавляет links.url_hash и удаляет бесполезный индекс по неограниченному original_url."""
+    columns = {column["name"] for column in inspect(bind).get_columns("links")}
+    with bind.begin() as conn:
+        if "url_hash" not in columns:
+            conn.execute(text("ALTER TABLE links ADD COLUMN url_hash BIGINT"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_links_original_url"))
+
+
+def backfill_links_url_hash(bind: Engine) -> None:
+    """Заполняет url_hash пачками, каждая пачка — отдельная транзакция."""
+    links = models.Link.__table__
+    stmt = update(links).where(links.c.id == bindparam("_id")).values(url_hash=bindparam("_hash"))
+    # Пагинация по ключу: каждая пачка продолжает с последнего id, а не просматривает таблицу заново
+    last_id = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(links.c.id, links.c.original_url)
+                .where(links.c.url_hash.is_(None), links.c.id > last_id)
+                .order_by(links.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return
+            conn.execute(stmt, [{"_id": row.id, "_hash": models.url_hash(row.original_url or "")} for row in rows])
+        last_id = rows[-1].id
+
+
+# Разовые миграции в порядке применения
+MIGRATIONS = [
+    seed_short_code_counter,
+    add_links_url_hash,
+    backfill_links_url_hash,
+]
+
+
+def schema_fingerprint() -> str:
+    """Отпечаток таблиц, столбцов и индексов моделей и списка разовых миграций."""
+    parts = [migration.__name__ for migration in MIGRATIONS]
+    for table in models.Base.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{type(column.type).__name__}" for column in table.columns)
+        parts.extend(sorted(str(index.name) for index in table.indexes))
+    return "schema:" + hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def _applied_names(bind: Engine) -> set[str]:
+    migrations_table = models.SchemaMigration.__table__
+    try:
+        with bind.connect() as conn:
+            return set(conn.execute(select(migrations_table.c.name)).scalars())
+    except DBAPIError:
+        # Новая БД: таблицы schema_migrations ещё нет
+        return set()
+
+
+def _mark_applied(bind: Engine, name: str) -> None:
+    with bind.begin() as conn:
+        conn.execute(
+            dialect_insert(bind.dialect.name)(models.SchemaMigration.__table__)
+            .values(name=name)
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+
+
+@contextmanager
+def migration_lock(bind: Engine):
+    """Блокировка на время прогона миграций, общая для всех процессов."""
+    if bind.dialect.name == "postgresql":
+        # Блокировка сессии держится на отдельном соединении без открытой транзакции
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    elif fcntl is not None and bind.url.database and bind.url.database != ":memory:":
+        with open(f"{bind.url.database}.migrate.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def run_migrations(bind: Engine = engine, force: bool = False) -> bool:
+    """Приводит схему к моделям; False — схема уже актуальна и ничего не выполнялось."""
+    fingerprint = schema_fingerprint()
+    if fingerprint in _applied_names(bind) and not force:
+        return False
+
+    with migration_lock(bind):
+        # Пока ждали блокировку, схему мог обновить другой воркер
+        applied = _applied_names(bind)
+        if fingerprint in applied and not force:
+            return False
+
+        models.Base.metadata.create_all(bind=bind)
+
+        for migration in MIGRATIONS:
+            if migration.__name__ in applied:
+                continue
+            migration(bind)
+            _mark_applied(bind, migration.__name__)
+
+        create_missing_indexes(bind)
+        _mark_applied(bind, fingerprint)
+    return True
+
+
+if __name__ == "__main__":
+    run_migrations(force=True)
+    print("✅ Миграции применены")
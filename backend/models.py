@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
+import hashlib
+
+
+def url_hash(url: str) -> int:
+    """64-битный префикс SHA-256 от URL (знаковый, под BIGINT)."""
+    return int.from_bytes(hashlib.sha256(url.encode()).digest()[:8], "big", signed=True)
 
 class User(Base):
     __tablename__ = "users"
@@ -18,13 +24,63 @@ class Link(Base):
     __tablename__ = "links"
     
     id = Column(Integer, primary_key=True, index=True)
-    original_url = Column(String, index=True)
+    original_url = Column(String)
+    url_hash = Column(BigInteger, nullable=True)  # models.url_hash(original_url), для поиска дублей
     short_code = Column(String, unique=True, index=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
     is_permanent = Column(Boolean, default=False)
-    last_accessed = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_accessed = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
     clicks = Column(Integer, default=0)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     
-    owner = relationship("User", back_populates="links")
\ No newline at end of file
+    owner = relationship("User", back_populates="links")
+
+    __table_args__ = (
+        Index("ix_links_owner_url_hash", "owner_id", "url_hash"),
+        Index("ix_links_clicks_id", "clicks", "id"),  # Прогрев кэша: самые популярные ссылки
+        # Список ссылок пользователя: keyset по (created_at, id); в PostgreSQL остальные
+        # поля фильтров хранятся в индексе (original_url не влезает в строку индекса)
+        Index(
+            "ix_links_owner_created_id", "owner_id", "created_at", "id",
+            postgresql_include=["short_code", "expires_at", "is_permanent", "clicks"],
+        ),
+    )
+
+class SchemaMigration(Base):
+    """Применённые разовые миграции (см. migrations.py)."""
+    __tablename__ = "schema_migrations"
+
+    name = Column(String(100), primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ShortCodeCounter(Base):
+    """Счётчик, из которого воркеры резервируют блоки идентификаторов коротких кодов."""
+    __tablename__ = "short_code_counter"
+
+    id = Column(Integer, primary_key=True)
+    next_value = Column(BigInteger, nullable=False, default=0)
+
+class LinkClickBucket(Base):
+    """Переходы по ссылке за интервал (минута, час или сутки UTC); заполняется clicks.flush_clicks."""
+    __tablename__ = "link_click_buckets"
+
+    short_code = Column(String, primary_key=True)
+    bucket_seconds = Column(Integer, primary_key=True)  # 60, 3600 или 86400
+    bucket_start = Column(DateTime, primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+
+class AppliedClickSnapshot(Base):
+    """Снимки переходов, уже записанные в БД (см. clicks.py); пишется в транзакции снимка."""
+    __tablename__ = "applied_click_snapshots"
+
+    snapshot_id = Column(String, primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class CacheOutbox(Base):
+    """Изменённые ссылки, которые нужно записать в кэш (см. outbox.py); пишется в транзакции изменения."""
+    __tablename__ = "cache_outbox"
+
+    id = Column(Integer, primary_key=True)
+    short_code = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,183 @@
+"""Согласование кэша ссылок с БД после изменений.
+
+Изменение ссылки (правка URL или срока, удаление, перезапись при импорте) в той
+же транзакции добавляет строку в таблицу cache_outbox, а после коммита сразу
+записывается в кэш (cache.write_through), без удаления ключа. Если запись в Redis
+не удалась или процесс завершился между коммитом и записью, изменение повторяет
+фоновая задача relay: через CACHE_OUTBOX_DELAY секунд она заново читает ссылки из
+основной БД и записывает их текущее состояние в кэш. Задержка заодно исправляет
+загрузку при промахе, которая прочитала ссылку до коммита и записала её в кэш
+после него.
+
+Задача reconcile обходит ключи link:* и сверяет URL и TTL с БД: расхождения,
+возникшие в обход outbox (ручные правки БД, потерянные сообщения), исправляются
+той же записью в кэш.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import redis
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+import cache
+import models
+import schemas
+import ttl_policy
+from database import SessionLocal, redis_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_OUTBOX_INTERVAL = float(os.getenv("CACHE_OUTBOX_INTERVAL", "5"))
+# Через сколько секунд после изменения relay повторяет запись в кэш
+CACHE_OUTBOX_DELAY = float(os.getenv("CACHE_OUTBOX_DELAY", "2"))
+CACHE_OUTBOX_BATCH_SIZE = int(os.getenv("CACHE_OUTBOX_BATCH_SIZE", "500"))
+CACHE_RECONCILE_INTERVAL = float(os.getenv("CACHE_RECONCILE_INTERVAL", "600"))
+CACHE_RECONCILE_BATCH_SIZE = int(os.getenv("CACHE_RECONCILE_BATCH_SIZE", "500"))
+# Допуск при сравнении TTL ключа с оставшимся сроком жизни ссылки, с
+RECONCILE_TTL_SLACK = 2
+
+stats = {
+    "written": 0,          # изменений записано в кэш сразу после коммита
+    "failed": 0,           # не записано (Redis недоступен), повторит relay
+    "relayed": 0,          # строк outbox обработано relay
+    "pending": 0,          # строк outbox после последнего запуска relay
+    "last_relay_at": None,
+    "reconciled_keys": 0,  # ключей проверено сверкой
+    "drift": 0,            # расхождений кэша с БД исправлено сверкой
+    "last_reconcile_at": None,
+    "last_reconcile_seconds": None,
+}
+
+
+def enqueue(db: Session, short_codes) -> None:
+    """Добавляет изменённые коды в outbox; коммитит вызывающий вместе с изменением."""
+    db.add_all(models.CacheOutbox(short_code=short_code) for short_code in short_codes)
+
+
+def write_through(records=(), deleted=()) -> None:
+    """Запись изменений в кэш после коммита; сбой Redis не ломает запрос — его повторит relay."""
+    records = list(records)
+    deleted = list(deleted)
+    try:
+        cache.write_through(records, deleted)
+    except redis.RedisError:
+        stats["failed"] += len(records) + len(deleted)
+        logger.warning("Не удалось записать изменения ссылок в кэш, повторит outbox", exc_info=True)
+        return
+    stats["written"] += len(records) + len(deleted)
+
+
+def _load_state(db: Session, short_codes) -> tuple[list[schemas.LinkRecord], list[str]]:
+    """Текущие записи ссылок из БД и коды, которых в ней больше нет."""
+    links = db.scalars(select(models.Link).where(models.Link.short_code.in_(list(short_codes)))).all()
+    records = [schemas.LinkRecord.model_validate(link) for link in links]
+    found = {record.short_code for record in records}
+    return records, [short_code for short_code in short_codes if short_code not in found]
+
+
+def sync(db: Session, short_codes) -> None:
+    """Как write_through, но состояние ссылок читается из БД (например, после перезаписи импортом)."""
+    if short_codes:
+        write_through(*_load_state(db, short_codes))
+
+
+def relay(batch_size: int = CACHE_OUTBOX_BATCH_SIZE) -> dict:
+    """Повторяет записи в кэш для строк outbox старше CACHE_OUTBOX_DELAY и удаляет их."""
+    outbox = models.CacheOutbox
+    relayed = 0
+    with SessionLocal() as db:
+        while True:
+            # В БД время хранится без часового пояса, в UTC
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=CACHE_OUTBOX_DELAY)
+            rows = db.execute(
+                select(outbox.id, outbox.short_code)
+                .where(outbox.created_at <= cutoff)
+                .order_by(outbox.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            # При сбое Redis исключение оставляет строки в outbox до следующего запуска
+            cache.write_through(*_load_state(db, {row.short_code for row in rows}))
+            db.execute(delete(outbox).where(outbox.id.in_([row.id for row in rows])))
+            db.commit()
+            relayed += len(rows)
+            if len(rows) < batch_size:
+                break
+        pending = db.scalar(select(func.count()).select_from(outbox))
+
+    stats.update(
+        relayed=stats["relayed"] + relayed,
+        pending=pending,
+        last_relay_at=datetime.now(timezone.utc).isoformat(),
+    )
+    return {"relayed": relayed, "pending": pending}
+
+
+def _find_drift(db: Session, keys: list[str]) -> tuple[list[schemas.LinkRecord], list[str]]:
+    """Ключи link:*, расходящиеся с БД: (записи для перезаписи, коды удалённых ссылок)."""
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.get(key)
+        pipe.ttl(key)
+    replies = pipe.execute()
+    cached = {key[len("link:"):]: (url, ttl) for key, url, ttl in zip(keys, replies[::2], replies[1::2])}
+
+    links = {
+        link.short_code: link
+        for link in db.scalars(select(models.Link).where(models.Link.short_code.in_(list(cached))))
+    }
+    records, deleted = [], []
+    for short_code, (url, ttl) in cached.items():
+        if url is None:
+            continue  # ключ истёк во время сверки
+        link = links.get(short_code)
+        if link is None or ttl_policy.is_expired(link.expires_at):
+            if url:
+                deleted.append(short_code)
+            continue
+        outlives_link = link.expires_at is not None and ttl > ttl_policy.seconds_left(link.expires_at) + RECONCILE_TTL_SLACK
+        if url != link.original_url or outlives_link:
+            records.append(schemas.LinkRecord.model_validate(link))
+    return records, deleted
+
+
+def reconcile(batch_size: int = CACHE_RECONCILE_BATCH_SIZE) -> dict:
+    """Сверяет закэшированные URL и TTL с основной БД и исправляет расхождения."""
+    started = time.perf_counter()
+    checked = drift = 0
+
+    def check(keys: list[str]) -> None:
+        nonlocal checked, drift
+        with SessionLocal() as db:
+            records, deleted = _find_drift(db, keys)
+        if records or deleted:
+            cache.write_through(records, deleted)
+        checked += len(keys)
+        drift += len(records) + len(deleted)
+
+    batch = []
+    for key in redis_client.scan_iter(match="link:*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            check(batch)
+            batch = []
+    if batch:
+        check(batch)
+
+    if drift:
+        logger.warning("Сверка кэша: исправлено %s расхождений с БД из %s ключей", drift, checked)
+    stats.update(
+        reconciled_keys=stats["reconciled_keys"] + checked,
+        drift=stats["drift"] + drift,
+        last_reconcile_at=datetime.now(timezone.utc).isoformat(),
+        last_reconcile_seconds=round(time.perf_counter() - started, 3),
+    )
+    return {"checked": checked, "drift": drift}
+
+
+def get_stats() -> dict:
+    return dict(stats)
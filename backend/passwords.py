@@ -0,0 +1,24 @@
+"""Хэширование паролей (bcrypt через passlib).
+
+Модуль намеренно лёгкий: его функции выполняются в отдельных процессах пула
+хэширования (см. auth.hash_password), которые импортируют только его.
+"""
+import os
+
+from passlib.context import CryptContext
+
+# Хэши с меньшим числом раундов считаются устаревшими и пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS
+)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Проверка пароля; если хэш устарел (needs_update), возвращается новый хэш."""
+    return pwd_context.verify_and_update(password, hashed_password)
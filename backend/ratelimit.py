@@ -0,0 +1,156 @@
+"""Ограничение частоты запросов к созданию ссылок и авторизации.
+
+Token bucket в Redis: пополнение и списание токена выполняет один Lua-скрипт
+(EVALSHA), поэтому проверка атомарна для всех воркеров и стоит одного обращения
+к Redis. Ключ — маршрут и пользователь (или IP для анонимных запросов). Если Redis
+недоступен, воркер временно ограничивает запросы собственными корзинами в памяти.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from database import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# Брать адрес клиента из X-Forwarded-For — только если сервис доступен исключительно
+# через балансировщик (например, на Render): иначе заголовок подставляет сам клиент
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+# Сколько доверенных прокси дописывают адрес в X-Forwarded-For перед приложением
+RATE_LIMIT_TRUSTED_PROXIES = max(1, int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1")))
+LOCAL_BUCKETS_SIZE = 10000
+FALLBACK_WARNING_INTERVAL = 60
+
+
+def _parse_limit(value: str) -> tuple[int, float]:
+    """"запросов/секунд" -> (ёмкость корзины, токенов в секунду)."""
+    requests, _, seconds = value.partition("/")
+    return int(requests), int(requests) / float(seconds or 1)
+
+
+# Лимиты по маршрутам в формате "запросов/секунд"
+LIMITS = {
+    "shorten": _parse_limit(os.getenv("RATE_LIMIT_SHORTEN", "60/60")),
+    "shorten_batch": _parse_limit(os.getenv("RATE_LIMIT_SHORTEN_BATCH", "10/60")),
+    "token": _parse_limit(os.getenv("RATE_LIMIT_TOKEN", "10/60")),
+    "register": _parse_limit(os.getenv("RATE_LIMIT_REGISTER", "5/60")),
+}
+
+stats = {route: {"allowed": 0, "limited": 0, "fallback": 0} for route in LIMITS}
+
+_bucket_script = async_redis_client.register_script("""
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate))
+return {allowed, math.floor(tokens), retry_after}
+""")
+
+
+class RateLimited(Exception):
+    """Лимит запросов исчерпан."""
+
+    def __init__(self, limit: int, retry_after: float):
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class LocalBuckets:
+    """Те же корзины в памяти воркера — запасной вариант, пока Redis недоступен."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float) -> tuple[bool, int, int]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._data.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._data[key] = (tokens, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        retry_after = 0 if allowed else math.ceil((1 - tokens) * 1000 / rate)
+        return allowed, math.floor(tokens), retry_after
+
+
+_local = LocalBuckets(LOCAL_BUCKETS_SIZE)
+_fallback_warned_at = 0.0
+
+
+def client_ip(request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        hops = [
+            hop.strip()
+            for header in request.headers.getlist("x-forwarded-for")
+            for hop in header.split(",")
+            if hop.strip()
+        ]
+        # Каждый прокси дописывает в конец адрес, с которого к нему пришёл запрос;
+        # всё левее адреса, записанного первым доверенным прокси, мог подставить клиент
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return hops[-RATE_LIMIT_TRUSTED_PROXIES]
+    return request.client.host if request.client else "unknown"
+
+
+async def check(route: str, request, response=None, user_id: int | None = None) -> None:
+    """Списывает токен маршрута; при исчерпании лимита — RateLimited.
+
+    С response выставляет заголовки X-RateLimit-Limit и X-RateLimit-Remaining.
+    """
+    global _fallback_warned_at
+    if not RATE_LIMIT_ENABLED:
+        return
+    capacity, rate = LIMITS[route]
+    identity = f"user:{user_id}" if user_id is not None else f"ip:{client_ip(request)}"
+    key = f"rl:{route}:{identity}"
+    try:
+        allowed, remaining, retry_after_ms = await _bucket_script(
+            keys=[key], args=[capacity, rate, int(time.time() * 1000)]
+        )
+    except redis.RedisError:
+        if time.monotonic() - _fallback_warned_at > FALLBACK_WARNING_INTERVAL:
+            _fallback_warned_at = time.monotonic()
+            logger.warning("Redis недоступен: лимиты запросов считаются в памяти воркера")
+        stats[route]["fallback"] += 1
+        allowed, remaining, retry_after_ms = _local.take(key, capacity, rate)
+
+    if not allowed:
+        stats[route]["limited"] += 1
+        raise RateLimited(capacity, retry_after_ms / 1000)
+    stats[route]["allowed"] += 1
+    if response is not None:
+        response.headers["X-RateLimit-Limit"] = str(capacity)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+
+
+def get_stats() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "limits": {route: {"capacity": capacity, "per_second": round(rate, 4)} for route, (capacity, rate) in LIMITS.items()},
+        "routes": stats,
+    }
@@ -0,0 +1,178 @@
+"""Фоновые задачи воркера с координацией через Redis.
+
+Каждая задача запускается по своему интервалу со случайным сдвигом (jitter),
+чтобы воркеры не просыпались одновременно. Задачи с leader_only=True выполняет
+только воркер, взявший аренду scheduler:lease:<задача> (SET NX PX); время
+последнего запуска хранится в Redis, поэтому при N воркерах задача всё равно
+выполняется примерно раз в интервал. Синхронные задачи выполняются в отдельном
+потоке, их длительность ограничена таймаутом.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+
+import redis
+
+from database import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Доля интервала, на которую случайно сдвигается каждый запуск
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+# Запас времени аренды сверх таймаута задачи
+SCHEDULER_LEASE_MARGIN = float(os.getenv("SCHEDULER_LEASE_MARGIN", "30"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_release_lease_script = async_redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+class Job:
+    def __init__(self, name: str, fn, interval: float | None, timeout: float | None, leader_only: bool):
+        self.name = name
+        self.fn = fn
+        self.interval = interval        # None — один запуск при старте
+        self.timeout = timeout          # None — без ограничения
+        self.leader_only = leader_only
+        self.state = {
+            "interval": interval,
+            "leader_only": leader_only,
+            "running": False,
+            "runs": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "skipped": 0,               # задачу в этот раз выполнил другой воркер
+            "last_run_at": None,
+            "last_duration_seconds": None,
+            "last_status": None,        # ok, failed, timeout
+            "last_error": None,
+        }
+
+
+_jobs: dict[str, Job] = {}
+_tasks: list[asyncio.Task] = []
+
+
+def add_job(name: str, fn, interval: float | None = None, timeout: float | None = 300, leader_only: bool = True) -> None:
+    """Регистрирует задачу; fn — функция (выполняется в потоке) или корутинная функция."""
+    _jobs[name] = Job(name, fn, interval, timeout, leader_only)
+
+
+def _lease_key(job: Job) -> str:
+    return f"scheduler:lease:{job.name}"
+
+
+def _last_run_key(job: Job) -> str:
+    return f"scheduler:last:{job.name}"
+
+
+async def _acquire(job: Job) -> str | None:
+    """Берёт аренду задачи; None — её выполняет другой воркер или она недавно выполнялась."""
+    token = f"{WORKER_ID}:{uuid.uuid4().hex[:6]}"
+    lease_ms = int(((job.timeout or job.interval or 0) + SCHEDULER_LEASE_MARGIN) * 1000)
+    if not await async_redis_client.set(_lease_key(job), token, nx=True, px=lease_ms):
+        return None
+    if job.interval is not None:
+        last = await async_redis_client.get(_last_run_key(job))
+        # Другой воркер уже выполнил задачу в этом интервале
+        if last is not None and time.time() - float(last) < job.interval * (1 - SCHEDULER_JITTER):
+            await _release_lease_script(keys=[_lease_key(job)], args=[token])
+            return None
+    return token
+
+
+async def _call(job: Job):
+    if asyncio.iscoroutinefunction(job.fn):
+        return await job.fn()
+    return await asyncio.to_thread(job.fn)
+
+
+async def run_job(job: Job) -> None:
+    token = None
+    if job.leader_only:
+        try:
+            token = await _acquire(job)
+        except redis.RedisError:
+            logger.warning("Задача %s пропущена: Redis недоступен", job.name)
+            token = None
+        if token is None:
+            job.state["skipped"] += 1
+            return
+
+    state = job.state
+    started = time.perf_counter()
+    state["running"] = True
+    state["last_run_at"] = datetime.now(timezone.utc).isoformat()
+    release = True
+    try:
+        await asyncio.wait_for(_call(job), job.timeout)
+        state["last_status"] = "ok"
+        state["last_error"] = None
+    except asyncio.TimeoutError:
+        # Поток задачи нельзя прервать: аренда остаётся до истечения, чтобы
+        # другой воркер не запустил ту же задачу поверх незавершённой
+        release = False
+        state["timeouts"] += 1
+        state["last_status"] = "timeout"
+        state["last_error"] = f"Превышен таймаут {job.timeout} с"
+        logger.error("Задача %s не уложилась в %s с", job.name, job.timeout)
+    except Exception as e:
+        state["failures"] += 1
+        state["last_status"] = "failed"
+        state["last_error"] = repr(e)
+        logger.exception("Ошибка в фоновой задаче %s", job.name)
+    finally:
+        state["running"] = False
+        state["runs"] += 1
+        state["last_duration_seconds"] = round(time.perf_counter() - started, 3)
+        if token is not None:
+            try:
+                await async_redis_client.set(_last_run_key(job), time.time())
+                if release:
+                    await _release_lease_script(keys=[_lease_key(job)], args=[token])
+            except redis.RedisError:
+                logger.warning("Не удалось освободить аренду задачи %s", job.name)
+
+
+def _jittered(seconds: float) -> float:
+    return seconds * (1 + random.uniform(-SCHEDULER_JITTER, SCHEDULER_JITTER))
+
+
+async def _loop(job: Job) -> None:
+    # Первый запуск сразу (с небольшим сдвигом), затем по интервалу
+    await asyncio.sleep(random.uniform(0, SCHEDULER_JITTER))
+    while True:
+        await run_job(job)
+        if job.interval is None:
+            return
+        await asyncio.sleep(_jittered(job.interval))
+
+
+def start() -> None:
+    for job in _jobs.values():
+        _tasks.append(asyncio.create_task(_loop(job), name=f"job:{job.name}"))
+
+
+async def stop() -> None:
+    pending = set(_tasks)
+    while pending:
+        # asyncio.wait_for в Python < 3.12 теряет отмену, пришедшую в момент завершения
+        # задачи, и цикл уходит в следующий sleep, поэтому отменяем, пока задачи не остановятся
+        for task in pending:
+            task.cancel()
+        _, pending = await asyncio.wait(pending, timeout=1)
+    _tasks.clear()
+
+
+def get_stats() -> dict:
+    return {"worker": WORKER_ID, "jobs": {name: dict(job.state) for name, job in _jobs.items()}}
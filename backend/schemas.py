@@ -18,6 +18,14 @@ class User(UserBase):
         from_attributes = True
 
 
+class UserClaims(BaseModel):
+    """Данные пользователя из проверенного токена."""
+    id: Optional[int] = None
+    username: str
+    jti: Optional[str] = None
+    exp: float
+
+
 class Link(BaseModel):
     id: int
     original_url: str
@@ -31,12 +39,45 @@ class Link(BaseModel):
     class Config:
         from_attributes = True
 
+class LinkRecord(Link):
+    """Полная запись ссылки, хранимая в кэше: поля Link и владелец для проверки прав."""
+    owner_id: Optional[int] = None
+
+
+class LinkListItem(BaseModel):
+    """Сокращённая запись для списка ссылок пользователя."""
+    short_code: str
+    original_url: str
+    created_at: datetime
+    expires_at: Optional[datetime] = None
+    is_permanent: bool
+    clicks: int
+
+    class Config:
+        from_attributes = True
+
+
+class LinkPage(BaseModel):
+    items: list[LinkListItem]
+    next_cursor: Optional[str] = None  # None — это последняя страница
+
+
+class ClickBucket(BaseModel):
+    start: datetime  # Начало интервала, UTC
+    clicks: int
+
+
+class LinkStats(Link):
+    series: Optional[list[ClickBucket]] = None  # Только при запросе ?series=
+
+
 class LinkCreate(BaseModel):
     original_url: str
     custom_alias: Optional[str] = None
     is_permanent: Optional[bool] = True  # Может быть None (автоматически определяется)
     expires_at: Optional[datetime] = None  # Можно задать срок истечения
     owner_id: Optional[int] = None
+    reuse_existing: bool = False  # Вернуть уже созданную пользователем ссылку на тот же URL вместо новой
     
     @field_validator('custom_alias')
     def validate_alias(cls, v):
@@ -45,6 +86,18 @@ class LinkCreate(BaseModel):
         return v
 
 
+class LinkImport(BaseModel):
+    """Строка импорта (формат выгрузки GET /links/export)."""
+    original_url: str
+    short_code: Optional[str] = None  # Без кода — будет сгенерирован
+    created_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    is_permanent: Optional[bool] = None  # По умолчанию — вечная, если нет expires_at
+    clicks: int = 0
+    last_accessed: Optional[datetime] = None
+    owner_id: Optional[int] = None  # Учитывается только при импорте администратором
+
+
 class LinkExpiryUpdate(BaseModel):
     expires_at: datetime
 
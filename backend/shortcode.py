@@ -0,0 +1,150 @@
+"""Выделение коротких кодов без коллизий.
+
+Каждый воркер резервирует в БД блок идентификаторов одним UPDATE ... RETURNING
+и выдаёт их из памяти. Идентификатор переводится в base62; чтобы коды нельзя
+было перебрать по порядку, он предварительно перемешивается обратимой
+перестановкой (сеть Фейстеля с ключом из SHORT_CODE_SALT) в пространстве кодов
+той же длины. Разные идентификаторы всегда дают разные коды.
+"""
+import hashlib
+import os
+import string
+import threading
+from collections import deque
+
+from sqlalchemy import update
+
+import models
+from database import async_engine, engine
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "6"))
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "100"))
+SHORT_CODE_OBFUSCATE = os.getenv("SHORT_CODE_OBFUSCATE", "1") == "1"
+_KEY = hashlib.sha256((os.getenv("SHORT_CODE_SALT") or os.getenv("SECRET_KEY") or "").encode()).digest()
+
+FEISTEL_ROUNDS = 4
+
+_counter = models.ShortCodeCounter.__table__
+
+
+def _round(value: int, i: int) -> int:
+    digest = hashlib.blake2b(value.to_bytes(8, "big") + bytes([i]), key=_KEY, digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _feistel(value: int, half_bits: int) -> int:
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for i in range(FEISTEL_ROUNDS):
+        left, right = right, left ^ (_round(right, i) & mask)
+    return (left << half_bits) | right
+
+
+def _permute(value: int, size: int) -> int:
+    """Биекция на [0, size): сеть Фейстеля на ближайшей степени двойки с cycle walking."""
+    half_bits = ((size - 1).bit_length() + 1) // 2
+    while True:
+        value = _feistel(value, half_bits)
+        if value < size:
+            return value
+
+
+def encode_id(value: int) -> str:
+    """Переводит идентификатор в короткий код не короче SHORT_CODE_LENGTH символов."""
+    length = SHORT_CODE_LENGTH
+    while value >= BASE ** length:
+        length += 1
+    if SHORT_CODE_OBFUSCATE:
+        value = _permute(value, BASE ** length)
+
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, BASE)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+class _IdBlocks:
+    """Зарезервированные воркером блоки идентификаторов."""
+
+    def __init__(self):
+        self._blocks: deque = deque()
+        self._lock = threading.Lock()
+
+    def take(self) -> int | None:
+        with self._lock:
+            while self._blocks:
+                start, end = self._blocks[0]
+                if start < end:
+                    self._blocks[0] = (start + 1, end)
+                    return start
+                self._blocks.popleft()
+            return None
+
+    def add(self, start: int, size: int) -> None:
+        with self._lock:
+            self._blocks.append((start, start + size))
+
+
+_blocks = _IdBlocks()
+
+
+def _reserve_stmt(size: int):
+    return (
+        update(_counter)
+        .where(_counter.c.id == 1)
+        .values(next_value=_counter.c.next_value + size)
+        .returning(_counter.c.next_value)
+    )
+
+
+def _reserve(size: int) -> None:
+    # Отдельная короткая транзакция, не связанная с сессией вызывающего
+    with engine.begin() as conn:
+        end = conn.execute(_reserve_stmt(size)).scalar_one()
+    _blocks.add(end - size, size)
+
+
+async def _reserve_async(size: int) -> None:
+    async with async_engine.begin() as conn:
+        end = (await conn.execute(_reserve_stmt(size))).scalar_one()
+    _blocks.add(end - size, size)
+
+
+def next_id() -> int:
+    while (value := _blocks.take()) is None:
+        _reserve(SHORT_CODE_BLOCK_SIZE)
+    return value
+
+
+async def next_id_async() -> int:
+    while (value := _blocks.take()) is None:
+        await _reserve_async(SHORT_CODE_BLOCK_SIZE)
+    return value
+
+
+def next_ids(count: int) -> list[int]:
+    """Выделяет count идентификаторов; недостающие резервируются одним блоком."""
+    ids = []
+    while len(ids) < count:
+        value = _blocks.take()
+        if value is None:
+            _reserve(max(count - len(ids), SHORT_CODE_BLOCK_SIZE))
+        else:
+            ids.append(value)
+    return ids
+
+
+def generate() -> str:
+    return encode_id(next_id())
+
+
+async def generate_async() -> str:
+    return encode_id(await next_id_async())
+
+
+def generate_many(count: int) -> list[str]:
+    return [encode_id(value) for value in next_ids(count)]
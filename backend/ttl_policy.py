@@ -0,0 +1,296 @@
+"""Время жизни ссылок в кэше.
+
+TTL ключа link:<код> выбирается по популярности ссылки: затухающий счётчик
+переходов в памяти воркера (период полураспада TTL_POPULARITY_HALF_LIFE) относит
+код к уровню hot, warm или cold, и популярные ссылки живут в Redis дольше
+непопулярных. TTL никогда не превышает оставшийся срок жизни ссылки (expires_at),
+поэтому истёкшая ссылка не продолжает перенаправлять из кэша.
+
+Фоновая уборка держит суммарный объём кэша ссылок — URL (link:*) вместе с их
+записями (linkrec:*) — в пределах LINK_CACHE_MAX_BYTES: при превышении первыми
+вытесняются наименее популярные.
+Уборку выполняет один воркер, поэтому популярность для неё берётся не из его
+счётчика, а из общего для кластера ZSET links:popularity: flusher переходов
+добавляет в него переходы всех воркеров, уборка перед ранжированием уменьшает
+счёт с тем же периодом полураспада.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import redis
+
+from database import redis_client
+
+logger = logging.getLogger(__name__)
+
+TIER_TTLS = {
+    "hot": int(os.getenv("LINK_TTL_HOT", "86400")),
+    "warm": int(os.getenv("LINK_TTL_WARM", "3600")),
+    "cold": int(os.getenv("LINK_TTL_COLD", "300")),
+}
+# Пороги затухающего счётчика переходов для уровней hot и warm
+TTL_HOT_SCORE = float(os.getenv("TTL_HOT_SCORE", "50"))
+TTL_WARM_SCORE = float(os.getenv("TTL_WARM_SCORE", "3"))
+TTL_POPULARITY_HALF_LIFE = float(os.getenv("TTL_POPULARITY_HALF_LIFE", "600"))
+TTL_POPULARITY_TRACKED = int(os.getenv("TTL_POPULARITY_TRACKED", "100000"))
+
+# Предел объёма кэша ссылок (URL и запись ссылки) в байтах (0 — без ограничения) и период уборки
+LINK_CACHE_MAX_BYTES = int(os.getenv("LINK_CACHE_MAX_BYTES", "0"))
+LINK_CACHE_SWEEP_INTERVAL = float(os.getenv("LINK_CACHE_SWEEP_INTERVAL", "60"))
+# Уборка освобождает память с запасом, чтобы не срабатывать на каждой новой ссылке
+LINK_CACHE_SWEEP_TARGET = 0.9
+# Накладные расходы Redis на ключ, если MEMORY USAGE недоступна
+KEY_OVERHEAD_BYTES = 64
+
+# Общая популярность ссылок (затухающие счётчики переходов всех воркеров)
+POPULARITY_KEY = "links:popularity"
+POPULARITY_DECAYED_AT_KEY = "links:popularity:decayed_at"
+# Счёт ниже этого порога считается нулевым и удаляется из ZSET
+POPULARITY_MIN_SCORE = 0.01
+
+
+class DecayingCounter:
+    """Счётчики с экспоненциальным затуханием для ограниченного числа ключей (LRU)."""
+
+    def __init__(self, maxsize: int, half_life: float):
+        self.maxsize = maxsize
+        self.half_life = half_life
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _decayed(self, item, now: float) -> float:
+        value, updated = item
+        return value * 0.5 ** ((now - updated) / self.half_life)
+
+    def hit(self, key) -> float:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            value = (self._decayed(item, now) if item is not None else 0.0) + 1
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def score(self, key) -> float:
+        with self._lock:
+            item = self._data.get(key)
+        return self._decayed(item, time.monotonic()) if item is not None else 0.0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+popularity = DecayingCounter(TTL_POPULARITY_TRACKED, TTL_POPULARITY_HALF_LIFE)
+
+stats = {
+    "tiers": {tier: {"hits": 0, "misses": 0, "stores": 0} for tier in TIER_TTLS},
+    "expiry_capped": 0,    # TTL укорочен до срока жизни ссылки
+    "expired": 0,          # ссылка уже истекла и не кэшируется
+    "memory": {tier: {"keys": 0, "bytes": 0} for tier in TIER_TTLS},
+    "memory_bytes": 0,
+    "evicted_total": 0,
+    "last_sweep_at": None,
+    "last_sweep_seconds": None,
+}
+
+
+def touch(short_code: str) -> None:
+    """Учитывает переход по ссылке."""
+    popularity.hit(short_code)
+
+
+def record_clicks(counts: dict[str, int]) -> None:
+    """Добавляет переходы из снимка flusher в общую популярность."""
+    if not counts:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code, n in counts.items():
+        pipe.zincrby(POPULARITY_KEY, n, short_code)
+    pipe.execute()
+
+
+def _decay_shared_popularity() -> None:
+    """Уменьшает общий счёт пропорционально времени с прошлой уборки."""
+    now = time.time()
+    decayed_at = redis_client.getset(POPULARITY_DECAYED_AT_KEY, now)
+    if decayed_at is None:
+        return
+    factor = 0.5 ** (max(0.0, now - float(decayed_at)) / TTL_POPULARITY_HALF_LIFE)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: factor})
+    pipe.zremrangebyscore(POPULARITY_KEY, "-inf", POPULARITY_MIN_SCORE)
+    pipe.zremrangebyrank(POPULARITY_KEY, 0, -TTL_POPULARITY_TRACKED - 1)
+    pipe.execute()
+
+
+def _shared_scores(short_codes: list[str], batch_size: int) -> list[float]:
+    scores = []
+    for i in range(0, len(short_codes), batch_size):
+        pipe = redis_client.pipeline(transaction=False)
+        for short_code in short_codes[i:i + batch_size]:
+            pipe.zscore(POPULARITY_KEY, short_code)
+        scores.extend(score or 0.0 for score in pipe.execute())
+    return scores
+
+
+def tier_for(short_code: str) -> str:
+    score = popularity.score(short_code)
+    if score >= TTL_HOT_SCORE:
+        return "hot"
+    if score >= TTL_WARM_SCORE:
+        return "warm"
+    return "cold"
+
+
+def record_lookup(short_code: str, hit: bool) -> None:
+    stats["tiers"][tier_for(short_code)]["hits" if hit else "misses"] += 1
+
+
+def seconds_left(expires_at: datetime) -> float:
+    # В БД время хранится без часового пояса, в UTC
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return (expires_at - datetime.now(timezone.utc)).total_seconds()
+
+
+def ttl_for(short_code: str, expires_at: datetime | None = None, tier: str | None = None) -> int:
+    """TTL в секундах для ссылки; 0 — ссылка истекла и кэшировать её нельзя."""
+    tier = tier or tier_for(short_code)
+    ttl = TIER_TTLS[tier]
+    if expires_at is not None:
+        left = int(seconds_left(expires_at))
+        if left <= 0:
+            stats["expired"] += 1
+            return 0
+        if left < ttl:
+            stats["expiry_capped"] += 1
+            ttl = left
+    stats["tiers"][tier]["stores"] += 1
+    return ttl
+
+
+def is_expired(expires_at: datetime | None) -> bool:
+    return expires_at is not None and seconds_left(expires_at) <= 0
+
+
+_memory_usage_supported = True
+
+
+def _key_sizes(keys: list[str], record_key) -> list[tuple[int, int]]:
+    """(байт URL и записи ссылки, мс до истечения URL) для каждого ключа link:*."""
+    global _memory_usage_supported
+    if _memory_usage_supported:
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+            pipe.memory_usage(record_key(key[len("link:"):]))
+            pipe.pttl(key)
+        try:
+            replies = pipe.execute()
+            return [
+                ((size or 0) + (record_size or 0), ttl_ms)
+                for size, record_size, ttl_ms in zip(replies[::3], replies[1::3], replies[2::3])
+            ]
+        except redis.ResponseError:
+            # MEMORY USAGE недоступна (например, в fakeredis) — оцениваем по длине значений
+            _memory_usage_supported = False
+
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.strlen(key)
+        pipe.hgetall(record_key(key[len("link:"):]))
+        pipe.pttl(key)
+    replies = pipe.execute()
+    sizes = []
+    for key, length, record, ttl_ms in zip(keys, replies[::3], replies[1::3], replies[2::3]):
+        size = length + len(key) + KEY_OVERHEAD_BYTES
+        if record:
+            size += sum(len(field) + len(value) for field, value in record.items()) + len(key) + KEY_OVERHEAD_BYTES
+        sizes.append((size, ttl_ms))
+    return sizes
+
+
+def sweep(batch_size: int = 1000) -> dict:
+    """Считает объём кэша ссылок по уровням и вытесняет непопулярные сверх LINK_CACHE_MAX_BYTES."""
+    # Модуль cache сам импортирует ttl_policy
+    import cache
+
+    started = time.perf_counter()
+    entries = []
+    memory = {tier: {"keys": 0, "bytes": 0} for tier in TIER_TTLS}
+    batch = []
+    for key in redis_client.scan_iter(match="link:*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            entries.extend(zip(batch, _key_sizes(batch, cache._record_key)))
+            batch = []
+    if batch:
+        entries.extend(zip(batch, _key_sizes(batch, cache._record_key)))
+
+    total = 0
+    ranked = []
+    for key, (size, ttl_ms) in entries:
+        short_code = key[len("link:"):]
+        tier = tier_for(short_code)
+        memory[tier]["keys"] += 1
+        memory[tier]["bytes"] += size
+        total += size
+        ranked.append((ttl_ms, short_code, size, tier))
+
+    _decay_shared_popularity()
+    evicted = 0
+    if LINK_CACHE_MAX_BYTES and total > LINK_CACHE_MAX_BYTES:
+        scores = _shared_scores([item[1] for item in ranked], batch_size)
+        # Первыми уходят самые непопулярные, среди равных — те, что и так скоро истекут
+        ranked = sorted(zip(scores, ranked), key=lambda item: (item[0], item[1][0]))
+        target = LINK_CACHE_MAX_BYTES * LINK_CACHE_SWEEP_TARGET
+        victims = []
+        for _, (_, short_code, size, tier) in ranked:
+            if total <= target:
+                break
+            victims.append(short_code)
+            total -= size
+            memory[tier]["keys"] -= 1
+            memory[tier]["bytes"] -= size
+        # URL и запись ссылки (linkrec:*) удаляются вместе, L1 воркеров сбрасывается
+        cache.purge(victims, batch_size)
+        evicted = len(victims)
+        logger.info("Кэш ссылок: вытеснено %s ключей сверх %s байт", evicted, LINK_CACHE_MAX_BYTES)
+
+    stats.update(
+        memory=memory,
+        memory_bytes=total,
+        evicted_total=stats["evicted_total"] + evicted,
+        last_sweep_at=datetime.now(timezone.utc).isoformat(),
+        last_sweep_seconds=round(time.perf_counter() - started, 3),
+    )
+    return {"keys": len(entries) - evicted, "bytes": total, "evicted": evicted}
+
+
+def get_stats() -> dict:
+    tiers = {}
+    for tier, counters in stats["tiers"].items():
+        total = counters["hits"] + counters["misses"]
+        tiers[tier] = {
+            **counters,
+            "ttl": TIER_TTLS[tier],
+            "hit_ratio": round(counters["hits"] / total, 4) if total else None,
+            **stats["memory"][tier],
+        }
+    return {
+        "tiers": tiers,
+        "tracked": len(popularity),
+        "expiry_capped": stats["expiry_capped"],
+        "expired": stats["expired"],
+        "memory_bytes": stats["memory_bytes"],
+        "max_bytes": LINK_CACHE_MAX_BYTES or None,
+        "evicted_total": stats["evicted_total"],
+        "last_sweep_at": stats["last_sweep_at"],
+        "last_sweep_seconds": stats["last_sweep_seconds"],
+    }
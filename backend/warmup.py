@@ -0,0 +1,137 @@
+"""Прогрев кэша самыми популярными ссылками при запуске воркера.
+
+После деплоя или сброса Redis весь трафик редиректов уходит в БД. При старте
+воркер в фоне читает до WARMUP_TOP_N ссылок, по которым были переходы за
+WARMUP_RECENT_DAYS, в порядке убывания общего числа переходов (keyset-пагинация
+по индексу (clicks, id)). Это приближение «самых популярных за последнее время»:
+точный рейтинг по link_click_buckets требует агрегации по всем интервалам за
+период без подходящего индекса, а прогрев выполняется на каждом деплое.
+
+В Redis ссылки кладёт один воркер — взявший аренду warmup:lease (SET NX EX), и
+только отсутствующие ключи: закэшированные ссылки сохраняют TTL, выбранный
+политикой по популярности. Остальные воркеры при WARMUP_L1=1 заполняют свой L1,
+иначе прогрев у них сразу завершён. Готовность (GET /ready) наступает, когда
+прогрета доля WARMUP_READY_FRACTION, или когда прогрев завершился/упал.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import redis
+from sqlalchemy import and_, func, or_, select
+
+import cache
+import models
+import schemas
+import scheduler
+from database import ReadSessionLocal, redis_client
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "10000"))
+WARMUP_PAGE_SIZE = int(os.getenv("WARMUP_PAGE_SIZE", "1000"))
+WARMUP_RECENT_DAYS = float(os.getenv("WARMUP_RECENT_DAYS", "1"))
+WARMUP_L1 = os.getenv("WARMUP_L1", "0") == "1"
+WARMUP_READY_FRACTION = float(os.getenv("WARMUP_READY_FRACTION", "0.8"))
+# Аренда записи в Redis не снимается после прогрева: воркеры того же деплоя его не повторяют
+WARMUP_LEASE_SECONDS = int(os.getenv("WARMUP_LEASE_SECONDS", "300"))
+WARMUP_LEASE_KEY = "warmup:lease"
+
+state = {
+    "status": "pending",  # pending, running, done, failed, disabled
+    "target": None,
+    "warmed": 0,
+    "redis_writer": False,  # этот воркер записывал ссылки в Redis
+    "written": 0,           # ссылок записано в Redis (уже закэшированные пропускаются)
+    "started_at": None,
+    "seconds": None,
+}
+
+
+def _eligible(now: datetime):
+    return and_(
+        models.Link.last_accessed >= now - timedelta(days=WARMUP_RECENT_DAYS),
+        models.Link.expires_at.is_(None) | (models.Link.expires_at > now),
+    )
+
+
+def _page_query(now: datetime, after: tuple[int, int] | None, limit: int):
+    stmt = select(models.Link).where(_eligible(now))
+    if after is not None:
+        clicks, link_id = after
+        stmt = stmt.where(or_(
+            models.Link.clicks < clicks,
+            and_(models.Link.clicks == clicks, models.Link.id < link_id),
+        ))
+    return stmt.order_by(models.Link.clicks.desc(), models.Link.id.desc()).limit(limit)
+
+
+def is_ready() -> bool:
+    if state["status"] in ("done", "failed", "disabled"):
+        return True
+    target = state["target"]
+    return target is not None and state["warmed"] >= target * WARMUP_READY_FRACTION
+
+
+def _acquire_lease() -> bool:
+    try:
+        return bool(redis_client.set(WARMUP_LEASE_KEY, scheduler.WORKER_ID, nx=True, ex=WARMUP_LEASE_SECONDS))
+    except redis.RedisError:
+        logger.warning("Прогрев Redis пропущен: Redis недоступен")
+        return False
+
+
+def run() -> dict:
+    """Прогрев кэша; выполняется в отдельном потоке."""
+    if not WARMUP_ENABLED:
+        state["status"] = "disabled"
+        return state
+
+    started = time.perf_counter()
+    state.update(
+        status="running", warmed=0, written=0, redis_writer=_acquire_lease(),
+        started_at=datetime.now(timezone.utc).isoformat(),
+    )
+    if not state["redis_writer"] and not WARMUP_L1:
+        # Redis прогревает другой воркер, а своего L1 прогревать не нужно
+        state.update(status="done", target=0, seconds=0.0)
+        return state
+
+    now = datetime.now(timezone.utc)
+    try:
+        with ReadSessionLocal() as db:
+            eligible = db.scalar(select(func.count()).select_from(models.Link).where(_eligible(now)))
+            state["target"] = min(eligible, WARMUP_TOP_N)
+
+            after = None
+            while state["warmed"] < state["target"]:
+                limit = min(WARMUP_PAGE_SIZE, state["target"] - state["warmed"])
+                links = db.scalars(_page_query(now, after, limit)).all()
+                if not links:
+                    break
+                records = [schemas.LinkRecord.model_validate(link) for link in links]
+                if state["redis_writer"]:
+                    # Самым популярным — TTL уровня warm, пока счётчик воркера пуст
+                    state["written"] += cache.warm(records, tier="warm", only_missing=True)
+                if WARMUP_L1:
+                    # Самые популярные идут первыми, поэтому L1 заполняется ими, пока есть место
+                    for record in records:
+                        if len(cache.l1) >= cache.l1.maxsize:
+                            break
+                        cache.l1.set(record.short_code, record.original_url)
+                state["warmed"] += len(records)
+                after = (links[-1].clicks, links[-1].id)
+                db.expunge_all()
+        state["status"] = "done"
+    except Exception:
+        # Прогрев — оптимизация: воркер всё равно становится готовым
+        state["status"] = "failed"
+        logger.exception("Не удалось прогреть кэш ссылок")
+    state["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        "Прогрев кэша: %s из %s ссылок за %s с, в Redis записано %s",
+        state["warmed"], state["target"], state["seconds"], state["written"],
+    )
+    return state
@@ -0,0 +1,340 @@
+"""Нагрузочные сценарии для backend/main.py.
+
+Приложение запускается в этом же процессе (uvicorn в отдельном потоке) на SQLite
+или локальном PostgreSQL и fakeredis (REDIS_URL=memory://) или локальном redis-server.
+Запросы генерирует асинхронный httpx-клиент с фиксированным числом параллельных
+соединений; последовательности запросов строятся генератором с заданным seed,
+поэтому прогоны с одинаковыми параметрами сравнимы между собой.
+
+    python benchmarks/run.py                       # все сценарии, SQLite + fakeredis
+    python benchmarks/run.py -s zipf hot_key --requests 20000 --output result.json
+    python benchmarks/run.py --database-url postgresql://... --redis-url redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+SCENARIOS = ["hot_key", "zipf", "cold", "shorten_burst", "mixed_auth", "cleanup_under_load", "redirect_overhead"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк сервиса коротких ссылок")
+    parser.add_argument("-s", "--scenario", nargs="+", default=["all"], choices=SCENARIOS + ["all"])
+    parser.add_argument("--database-url", help="по умолчанию — новый файл SQLite во временном каталоге")
+    parser.add_argument("--redis-url", default="memory://", help="memory:// — fakeredis в процессе")
+    parser.add_argument("--requests", type=int, default=5000, help="запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=200, help="непрогретых запросов перед замером")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--links", type=int, default=2000, help="ссылок в наборе данных")
+    parser.add_argument("--expired", type=int, default=5000, help="устаревших ссылок для cleanup_under_load")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="показатель распределения Ципфа")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="файл для JSON-отчёта (по умолчанию stdout)")
+    args = parser.parse_args()
+    if "all" in args.scenario:
+        args.scenario = SCENARIOS
+    return args
+
+
+def configure(args: argparse.Namespace) -> None:
+    """Окружение приложения; вызывается до импорта модулей backend."""
+    if not args.database_url:
+        args.database_url = f"sqlite:///{tempfile.mkdtemp(prefix='shortener-bench-')}/bench.sqlite"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["REDIS_URL"] = args.redis_url
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    # Генератор нагрузки — один клиент, лимиты запросов его бы просто отсекли
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+class Server:
+    """uvicorn в фоновом потоке."""
+
+    def __init__(self, app, port: int):
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, name="bench-server", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Сервер не запустился")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(values) / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+async def run_load(client: httpx.AsyncClient, requests: list[tuple], concurrency: int) -> dict:
+    """Выполняет запросы (method, url, kwargs) заданным числом параллельных воркеров."""
+    latencies: list[float] = []
+    errors = 0
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for method, url, kwargs in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace, client: httpx.AsyncClient):
+        self.args = args
+        self.client = client
+        self.rng = random.Random(args.seed)
+        self.run_id = f"{args.seed}-{int(time.time())}"
+        self.headers: dict = {}
+        self.codes: list[str] = []
+        self._url_counter = 0
+
+    async def setup(self) -> None:
+        username = f"bench-{self.run_id}"
+        await self.client.post(
+            "/register", json={"username": username, "email": f"{username}@example.com", "password": "benchmark"}
+        )
+        response = await self.client.post("/token", data={"username": username, "password": "benchmark"})
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        items = [{"original_url": f"https://example.com/{self.run_id}/{i}"} for i in range(self.args.links)]
+        response = await self.client.post(
+            "/links/shorten/batch", json=items, headers=self.headers, timeout=None
+        )
+        response.raise_for_status()
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+        self.codes = [line["link"]["short_code"] for line in lines if "link" in line]
+        if len(self.codes) != self.args.links:
+            raise RuntimeError(f"Создано {len(self.codes)} ссылок из {self.args.links}")
+
+    def _redirect(self, code: str) -> tuple:
+        return ("GET", f"/{code}", {})
+
+    def _shorten(self, authenticated: bool = True) -> tuple:
+        self._url_counter += 1
+        url = f"https://example.com/{self.run_id}/new/{self._url_counter}"
+        if authenticated:
+            return ("POST", "/links/shorten", {"json": {"original_url": url}, "headers": self.headers})
+        return ("POST", "/links/shorten", {"json": {"original_url": url, "is_permanent": None}})
+
+    def _zipf_codes(self, count: int) -> list[str]:
+        weights = [1 / (rank ** self.args.zipf_s) for rank in range(1, len(self.codes) + 1)]
+        return self.rng.choices(self.codes, weights=weights, k=count)
+
+    async def _measure(self, make_requests) -> dict:
+        if self.args.warmup:
+            await run_load(self.client, make_requests(self.args.warmup), self.args.concurrency)
+        return await run_load(self.client, make_requests(self.args.requests), self.args.concurrency)
+
+    async def hot_key(self) -> dict:
+        return await self._measure(lambda n: [self._redirect(self.codes[0])] * n)
+
+    def _redirect_server_time(self) -> tuple[float, float]:
+        """Суммарное время и число редиректов по гистограмме задержек приложения."""
+        from prometheus_client import REGISTRY
+
+        labels = {"method": "GET", "route": "/{short_code}", "status": "307"}
+        return (
+            REGISTRY.get_sample_value("http_request_duration_seconds_sum", labels) or 0.0,
+            REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) or 0.0,
+        )
+
+    async def redirect_overhead(self) -> dict:
+        """hot_key через обработчик FastAPI и через быстрый путь (fastpath.py).
+
+        Время на стороне сервера берётся из гистограммы http_request_duration_seconds:
+        оно не зависит от генератора нагрузки, работающего в том же процессе.
+        """
+        import fastpath
+
+        results = {}
+        try:
+            for name, enabled in (("handler", False), ("fast_path", True)):
+                fastpath.REDIRECT_FAST_PATH = enabled
+                total_before, count_before = self._redirect_server_time()
+                results[name] = await self.hot_key()
+                total_after, count_after = self._redirect_server_time()
+                requests = count_after - count_before
+                results[name]["server_mean_us"] = (
+                    round((total_after - total_before) / requests * 1e6, 1) if requests else None
+                )
+        finally:
+            fastpath.REDIRECT_FAST_PATH = True
+        handler, fast = results["handler"], results["fast_path"]
+        return {
+            **fast,
+            "handler": handler,
+            "server_mean_gain_us": round(handler["server_mean_us"] - fast["server_mean_us"], 1),
+        }
+
+    async def zipf(self) -> dict:
+        return await self._measure(lambda n: [self._redirect(code) for code in self._zipf_codes(n)])
+
+    async def cold(self) -> dict:
+        """Каждая ссылка запрашивается один раз после сброса Redis и L1."""
+        import cache
+
+        await asyncio.to_thread(cache.purge, self.codes)
+        codes = self.codes[:]
+        self.rng.shuffle(codes)
+        return await run_load(self.client, [self._redirect(code) for code in codes], self.args.concurrency)
+
+    async def shorten_burst(self) -> dict:
+        return await self._measure(lambda n: [self._shorten() for _ in range(n)])
+
+    async def mixed_auth(self) -> dict:
+        """70% редиректов, 10% статистики, 10% созданий с токеном и 10% анонимных."""
+        def make(n):
+            requests = []
+            for code in self._zipf_codes(n):
+                roll = self.rng.random()
+                if roll < 0.7:
+                    requests.append(self._redirect(code))
+                elif roll < 0.8:
+                    requests.append(("GET", f"/links/{code}/stats", {"headers": self.headers}))
+                elif roll < 0.9:
+                    requests.append(self._shorten())
+                else:
+                    requests.append(self._shorten(authenticated=False))
+            return requests
+
+        return await self._measure(make)
+
+    async def cleanup_under_load(self) -> dict:
+        """Редиректы по Ципфу во время удаления --expired устаревших ссылок."""
+        import crud
+        import models
+        from database import SessionLocal
+
+        expired_at = datetime.now() - timedelta(days=1)
+        with SessionLocal() as db:
+            db.bulk_insert_mappings(models.Link, [
+                {
+                    "short_code": f"exp{self.run_id}-{i}",
+                    "original_url": f"https://example.com/{self.run_id}/expired/{i}",
+                    "url_hash": models.url_hash(f"https://example.com/{self.run_id}/expired/{i}"),
+                    "is_permanent": False,
+                    "expires_at": expired_at,
+                }
+                for i in range(self.args.expired)
+            ])
+            db.commit()
+
+        def cleanup() -> dict:
+            with SessionLocal() as db:
+                return crud.delete_expired_links(db)
+
+        cleanup_task = asyncio.create_task(asyncio.to_thread(cleanup))
+        requests = [self._redirect(code) for code in self._zipf_codes(self.args.requests)]
+        result = await run_load(self.client, requests, self.args.concurrency)
+        result["cleanup"] = await cleanup_task
+        return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenarios(args: argparse.Namespace) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+        bench = Bench(args, client)
+        await bench.setup()
+        results = {}
+        for name in args.scenario:
+            results[name] = await getattr(bench, name)()
+            print(f"{name}: {results[name]['rps']} rps, p99 {results[name]['p99_ms']} ms", file=sys.stderr)
+        return results
+
+
+def main() -> None:
+    args = parse_args()
+    configure(args)
+    import main as app_module
+
+    with Server(app_module.app, args.port):
+        results = asyncio.run(run_scenarios(args))
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": args.database_url.split("://", 1)[0],
+            "redis": args.redis_url.split("://", 1)[0],
+            "async_db": os.getenv("ASYNC_DB", "1") == "1",
+            "seed": args.seed,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "links": args.links,
+        },
+        "scenarios": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Время холодного старта backend/main.py.
+
+Каждый замер — новый процесс Python:
+  - python -X importtime -c "import main": время импорта по модулям (накопительно);
+  - python migrations.py: отдельный шаг миграций (без --auto-migrate);
+  - uvicorn main:app: время от запуска процесса до первого ответа и до готовности
+    (GET /ready отвечает 200).
+
+С --baseline отчёт сравнивается с прошлым: модули и этапы, ставшие медленнее
+больше чем на --tolerance, попадают в regressions, и скрипт завершается с кодом 1.
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Этапы и модули быстрее этого порога не сравниваются с базовым отчётом: их шум больше разницы
+MIN_COMPARED_MS = 20
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Время запуска сервиса коротких ссылок")
+    parser.add_argument("--database-url", help="по умолчанию — новый файл SQLite во временном каталоге")
+    parser.add_argument("--redis-url", default="memory://", help="memory:// — fakeredis в процессе")
+    parser.add_argument("--runs", type=int, default=3, help="замеров каждого этапа (в отчёте — медиана)")
+    parser.add_argument("--top", type=int, default=25, help="самых медленных модулей в отчёте")
+    parser.add_argument("--auto-migrate", action="store_true", help="миграции при запуске воркера (AUTO_MIGRATE=1)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=60, help="секунд ожидания готовности")
+    parser.add_argument("--baseline", help="прошлый JSON-отчёт для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост времени (доля)")
+    parser.add_argument("--output", help="файл для JSON-отчёта (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def environment(args: argparse.Namespace) -> dict:
+    if not args.database_url:
+        args.database_url = f"sqlite:///{tempfile.mkdtemp(prefix='shortener-startup-')}/startup.sqlite"
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=args.database_url,
+        REDIS_URL=args.redis_url,
+        AUTO_MIGRATE="1" if args.auto_migrate else "0",
+    )
+    env.setdefault("SECRET_KEY", "startup-secret-key")
+    env.setdefault("ALGORITHM", "HS256")
+    return env
+
+
+def import_times(env: dict) -> dict[str, float]:
+    """Накопительное время импорта модулей в секундах (вывод -X importtime)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1_000_000
+    return times
+
+
+def migrate_seconds(env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "migrations.py"], cwd=BACKEND_DIR, env=env, capture_output=True, check=True)
+    return time.perf_counter() - started
+
+
+def server_times(args: argparse.Namespace, env: dict) -> dict[str, float]:
+    """Секунды от запуска uvicorn до первого ответа и до готовности."""
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    first_response = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=5) as client:
+            while time.perf_counter() - started < args.timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Сервер завершился: {process.stderr.read().decode()[-2000:]}")
+                try:
+                    response = client.get("/ready")
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if first_response is None:
+                    # Первый ответ — воркер принимает запросы, редиректы уже работают
+                    first_response = time.perf_counter() - started
+                if response.status_code == 200:
+                    return {"first_response": first_response, "ready": time.perf_counter() - started}
+                time.sleep(0.01)
+        raise RuntimeError(f"Сервер не стал готов за {args.timeout} с")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def median_ms(values: list[float]) -> float:
+    return round(statistics.median(values) * 1000, 1)
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Этапы и модули, ставшие медленнее базового отчёта больше чем на tolerance."""
+    pairs = [(f"stage:{name}", value, baseline["stages_ms"].get(name)) for name, value in report["stages_ms"].items()]
+    pairs += [(f"module:{name}", value, baseline["all_modules_ms"].get(name)) for name, value in report["all_modules_ms"].items()]
+    regressions = []
+    for name, value, previous in pairs:
+        if previous is None or max(value, previous) < MIN_COMPARED_MS:
+            continue
+        if value > previous * (1 + tolerance):
+            regressions.append({"name": name, "ms": value, "baseline_ms": previous})
+    return regressions
+
+
+def main() -> None:
+    args = parse_args()
+    env = environment(args)
+
+    if not args.auto_migrate:
+        # Схема создаётся до замеров, как это сделал бы шаг развёртывания
+        migrate_seconds(env)
+
+    modules: dict[str, list[float]] = {}
+    stages: dict[str, list[float]] = {"import_main": [], "first_response": [], "ready": []}
+    if not args.auto_migrate:
+        stages["migrate"] = []
+    for run in range(args.runs):
+        for name, seconds in import_times(env).items():
+            modules.setdefault(name, []).append(seconds)
+        stages["import_main"].append(modules["main"][-1])
+        if not args.auto_migrate:
+            stages["migrate"].append(migrate_seconds(env))
+        for name, seconds in server_times(args, env).items():
+            stages[name].append(seconds)
+        print(f"run {run + 1}: first response {stages['first_response'][-1]:.3f} s", file=sys.stderr)
+
+    all_modules = {name: median_ms(values) for name, values in modules.items()}
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": args.database_url.split("://", 1)[0],
+            "redis": args.redis_url.split("://", 1)[0],
+            "auto_migrate": args.auto_migrate,
+            "runs": args.runs,
+        },
+        "stages_ms": {name: median_ms(values) for name, values in stages.items()},
+        "slowest_modules_ms": dict(sorted(all_modules.items(), key=lambda item: -item[1])[:args.top]),
+        "all_modules_ms": all_modules,
+    }
+    if args.baseline:
+        report["regressions"] = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import pandas as pd
 from datetime import datetime, timedelta
 import pytz
 
@@ -138,9 +139,15 @@ with st.expander("📋 Управление ссылками"):
     st.subheader("📊 Статистика ссылки")
     with st.form("stats_form"):
         stats_code = st.text_input("Короткий код для статистики", key="stats_code")
+        series_labels = {"Без графика": None, "По минутам (2 часа)": "minute", "По часам (7 дней)": "hour", "По дням (год)": "day"}
+        series_label = st.selectbox("График переходов", list(series_labels), key="stats_series")
         if st.form_submit_button("Показать статистику"):
             try:
-                response = requests.get(f"{API_BASE_URL}/links/{stats_code}/stats")
+                series = series_labels[series_label]
+                response = requests.get(
+                    f"{API_BASE_URL}/links/{stats_code}/stats",
+                    params={"series": series} if series else None
+                )
                 response.raise_for_status()
                 data = response.json()
                 st.markdown(f"""
@@ -151,10 +158,64 @@ with st.expander("📋 Управление ссылками"):
                 - 🔀 **Последний переход:** {format_datetime(data['last_accessed'])}
                 - 🔢 **Количество переходов:** {data['clicks']}
                 """)
+                if series:
+                    if data.get("series"):
+                        # API возвращает только непустые интервалы (UTC)
+                        chart = pd.DataFrame(data["series"])
+                        chart["start"] = pd.to_datetime(chart["start"]).dt.tz_localize("UTC").dt.tz_convert(MOSCOW_TZ)
+                        st.bar_chart(chart.set_index("start")["clicks"])
+                    else:
+                        st.info("За выбранный период переходов не было")
             except requests.exceptions.HTTPError:
                 st.error("❌ Ссылка не найдена")
             except Exception as e:
                 st.error(f"❌ Ошибка при получении статистики: {str(e)}")
 
+# --- Мои ссылки (постранично) ---
+if st.session_state.token:
+    with st.expander("🗂 Мои ссылки"):
+        col_permanent, col_expired, col_clicks = st.columns(3)
+        permanent_filter = col_permanent.selectbox("Тип", ["Все", "Вечные", "Временные"], key="my_links_permanent")
+        expired_filter = col_expired.selectbox("Срок", ["Все", "Действующие", "Истёкшие"], key="my_links_expired")
+        min_clicks = col_clicks.number_input("Минимум переходов", min_value=0, value=0, key="my_links_min_clicks")
+
+        params = {"limit": 20}
+        if permanent_filter != "Все":
+            params["permanent"] = permanent_filter == "Вечные"
+        if expired_filter != "Все":
+            params["expired"] = expired_filter == "Истёкшие"
+        if min_clicks:
+            params["min_clicks"] = int(min_clicks)
+
+        # Курсоры уже открытых страниц: назад — по стеку, вперёд — по next_cursor
+        if st.session_state.get("my_links_params") != params:
+            st.session_state.my_links_params = params
+            st.session_state.my_links_cursors = [None]
+        cursors = st.session_state.my_links_cursors
+
+        try:
+            page_params = {**params, "cursor": cursors[-1]} if cursors[-1] else params
+            response = requests.get(f"{API_BASE_URL}/users/me/links", params=page_params, headers=get_auth_headers())
+            response.raise_for_status()
+            page = response.json()
+            if page["items"]:
+                table = pd.DataFrame(page["items"])
+                table["created_at"] = table["created_at"].map(format_datetime)
+                table["expires_at"] = table["expires_at"].map(format_datetime)
+                st.dataframe(table, use_container_width=True, hide_index=True)
+            else:
+                st.info("Ссылок не найдено")
+
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            col_page.markdown(f"Страница {len(cursors)}")
+            if col_prev.button("⬅️ Назад", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+            if col_next.button("Вперёд ➡️", disabled=not page["next_cursor"]):
+                cursors.append(page["next_cursor"])
+                st.rerun()
+        except requests.exceptions.RequestException as e:
+            st.error(f"❌ Ошибка при получении списка ссылок: {e}")
+
 st.markdown("---")
 st.markdown("🔔 **Важно:** Ссылки удаляются автоматически, если не используются в течение 7 дней.")
\ No newline at end of file